@@ -34,20 +34,88 @@
     -------- ------------
          -r  Enable recurse subdirectories
          -o  set output directory
+
+■　バックエンド
+    Add/Extractは、コマンドの内容(パラメータ)だけを持ち、実行はバックエンドに任せる。
+    ExternalBackend: 7z.exe(もしくは7z、7za)を実行する。実行ファイルのパスは指定できる。
+    InProcessBackend: zipfile/tarfile/lzmaで、このプロセスの中で圧縮・解凍する。プロセスを起動しないので、小さなフォルダが大量にある場合に速い。
+        7z形式は書けないので、「-t7z」はLZMAのZIP、「-tzip」はDeflateのZIPになる。暗号化もできないので、パスワードを指定したら例外。
+        分割サイズ(volume_size)を指定した場合は、7z.exeと同じように「.001」「.002」…に分割して書き込む。
+    get_default_backend()は、7z.exeが見つかればExternalBackend、見つからなければInProcessBackendを返す。
 """
+import io
 import os
+import re
 import enum
+import json
+import time
+import lzma
+import shutil
+import bisect
+import fnmatch
+import tarfile
+import zipfile
+import datetime
+import threading
 import subprocess
+import collections
+import concurrent.futures
+
+try:
+    from hlib import hpath
+    from hlib import hidx
+    from hlib import hzip
+except ImportError:
+    try:
+        import hpath
+        import hidx
+        import hzip
+    except ImportError:
+        print('import hpath failed')
 
 
 # 普通にインストールしたら、ここにファイルがあるはず。
-# このファイルが無いと、このスクリプトは機能しない。
+# 環境変数「SENDTO_7Z_EXE」で、別の場所の7z.exeを指定できる。
 FP_EXE = r"C:\Program Files\7-Zip\7z.exe"
-FP_DLL = r"C:\Program Files\7-Zip\7z.dll"
+ENV_EXE = 'SENDTO_7Z_EXE'
+
+# 分割サイズの単位(7z.exeの「-v」と同じ)
+VOLUME_UNITS = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# InProcessBackendで「-t」に対応する形式(拡張子, 書き込みの設定)
+# 7z形式は書けないので、LZMAのZIPにする。
+IN_PROCESS_TYPES = {'7z': ('.zip', zipfile.ZIP_LZMA),
+                    'zip': ('.zip', zipfile.ZIP_DEFLATED),
+                    'tar': ('.tar', 'w|'),
+                    'xz': ('.tar.xz', 'w|xz'),
+                    'gzip': ('.tar.gz', 'w|gz')}
+
+# 7z形式のシグネチャ
+SIGNATURE_7Z = b"7z\xbc\xaf\x27\x1c"
+
+# InProcessBackendの読み込みのバッファサイズ
+IN_PROCESS_CHUNK_SIZE = 1024 ** 2
 
 # デフォルトのパスワード
 DFT_PWD = '0123456789' * 5
 
+# 進捗を標準出力に出すスイッチ
+# https://sevenzip.osdn.jp/chm/cmdline/switches/bs.htm
+# -bsp1: 進捗、-bso1: 標準出力、-bse1: エラー出力
+PROGRESS_SWITCHES = ['-bsp1', '-bso1', '-bse1']
+
+# 進捗の行の例「 23% 12 + folder\file.txt」(パーセント、ファイル数、操作、現在のファイル)
+RGX_PROGRESS = re.compile(r'^\s*(\d+)%(?:\s+(\d+))?(?:\s+[+=U.RTDA-]?\s*(.*))?$')
+
+# MB/sを計算する期間(秒)
+RATE_WINDOW = 5.0
+
+# 進捗を表示する間隔(秒)
+PROGRESS_INTERVAL = 0.5
+
+# 実行時間の記録ファイル(JSON Lines)
+FP_METRICS = os.path.join(hidx.DIR_APP_CACHE, '7z_metrics.jsonl')
+
 
 class ErrorCode(enum.IntEnum):
     # https://sevenzip.osdn.jp/chm/cmdline/exit_codes.htm
@@ -70,23 +138,31 @@ class ErrorCode(enum.IntEnum):
     USER_STOPPED = 255
 
 
+# エラーコードの説明
+def get_description(return_code):
+    if return_code in ErrorCode.__members__.values():
+        return ErrorCode(return_code).name
+    else:
+        return 'This returned code is not documented.'
+
+
 # subprocess.run()で7z.exeを実行する時のラッパー関数
 # エラーが発生したらエラーコードを表示する。
-def execute_statement(statement):
+# statementは、引数のリスト(Command.construct_args())。シェルを経由しないので、LinuxやmacOSでも実行できる。
+# cwdは、7z.exeのCWD。プロセス全体のCWDは変更しない。
+def execute_statement(statement, cwd=None):
     # execute
-    ret = subprocess.run(statement)
+    ret = subprocess.run(statement, cwd=cwd)
 
     # returned code
     return_code = ret.returncode
 
     # description
-    if return_code in ErrorCode.__members__.values():
-        description = ErrorCode(return_code).name
-    else:
-        description = 'This returned code is not documented.'
+    description = get_description(return_code)
 
     # print result
     print(f'returned code: {return_code}, description: {description}')
+    return return_code
 
 
 def enclose(s):
@@ -101,36 +177,73 @@ def is_str(s):
         return False
 
 
+# 「*.xml *.txt」のような空白区切りのワイルドカードを、引数のリストにする。
+def split_flt_exp(flt_exp):
+    return flt_exp.split() if is_str(flt_exp) else []
+
+
+# 「100m」のような分割サイズをバイト数にする。Noneや空文字の場合はNone(分割しない)
+def parse_volume_size(volume_size):
+    if not is_str(volume_size):
+        return None
+    m = re.fullmatch(r'([0-9]+)([bkmg]?)', volume_size.strip().lower())
+    if m is None:
+        raise ValueError(f'invalid volume size: {volume_size}')
+    return int(m.group(1)) * VOLUME_UNITS[m.group(2) or 'b']
+
+
 class Command:
-    # コンストラクタ
-    # EXEとDLLがシステム上に存在しているか？を確認しておく。
-    def __init__(self):
-        # ライブラリ「7z.dll」が見つからなかったら例外
-        if not os.path.isfile(FP_DLL):
-            raise ValueError(f'7z.dll was not found at {FP_EXE}')
+    # 「-mmt」(圧縮のスレッド数)を受けるか？圧縮のコマンドだけTrueにする。
+    uses_threads = False
 
-        # アプリケーション「7z.exe」が見つからなかったら例外
-        if not os.path.isfile(FP_EXE):
-            raise ValueError(f'7z.exe was not found at {FP_EXE}')
+    # コンストラクタ
+    # backendがNoneの場合は、get_default_backend()を使う。
+    def __init__(self, backend=None):
+        self.backend = backend if backend else get_default_backend()
 
-        # アプリケーションを登録
-        self.app = FP_EXE
+        # アプリケーションを登録(ExternalBackendの場合だけ使う)
+        self.app = getattr(self.backend, 'fp_exe', None)
         self.prm_lst = []
+        # 7z.exeのCWD。Noneの場合は、このプロセスのCWDを引き継ぐ。
+        self.cwd = None
+        # 表示用の名称
+        self.name = ''
+
+    # 7z.exeが使うスレッド数を設定する。
+    # https://sevenzip.osdn.jp/chm/cmdline/switches/method.htm#MultiThread
+    def set_threads(self, threads):
+        self.prm_lst = [i for i in self.prm_lst if not (is_str(i) and i.startswith('-mmt'))]
+        self.prm_lst.append(f'-mmt{threads}')
+
+    def execute(self):
+        return self.backend.execute(self)
 
+    # 処理するバイト数の見積もり。進捗のパーセントからMB/sとETAを計算するのに使う。分からない場合はNone
+    def get_total_size(self):
+        return None
+
+    # subprocess.run()に渡す引数のリスト
+    # パラメータリストで、要素が文字列で長さが存在する場合は、引数に加える。
+    # 引数毎にそのまま渡すので、パスをダブルクオートで括らない。
+    def construct_args(self):
+        return [self.app] + [i for i in self.prm_lst if type(i) == str and len(i) > 0]
+
+    # 表示用のステートメント。Windowsのコマンドラインと同じ規則でクオートする。
     def construct_statement(self):
-        # パラメータリストで、要素が文字列で長さが存在する場合は、ステートメントに加える。
-        return self.app + ' ' + ' '.join([i for i in self.prm_lst if type(i) == str and len(i) > 0])
+        return subprocess.list2cmdline(self.construct_args())
 
 
 class Add(Command):
     # Adds files to archive.
+    uses_threads = True
+
     def __init__(self,
                  dir_in, dir_out, fn_out_wo_ext,
                  flt_exp='*', archive_type='7z', volume_size='100m',
-                 pwd=DFT_PWD, header_encryption=True, recurse=True):
+                 pwd=DFT_PWD, header_encryption=True, recurse=True, backend=None):
         """ Constructor
         ----------- 必須 -----------
-        :param dir_in:　圧縮対象のファイルが存在するフォルダ。CWDとして設定される。
+        :param dir_in:　圧縮対象のファイルが存在するフォルダ。7z.exeのCWDとして設定される。
         :param dir_out: 圧縮されたファイルを保存するフォルダ。
         :param fn_out_wo_ext: 圧縮ファイルの拡張子無しのファイル名称
 
@@ -141,21 +254,31 @@ class Add(Command):
         :param pwd: パスワード
         :param header_encryption: ファイルの名称等のヘッダー情報も隠すフラグ。
         :param recurse: 再帰検索のフラグ。
+        :param backend: ExternalBackendもしくはInProcessBackend。Noneの場合はget_default_backend()
         """
-        super().__init__()
+        super().__init__(backend=backend)
 
         # 圧縮コマンド
         # https://sevenzip.osdn.jp/chm/cmdline/commands/add.htm
         self.cmd = 'a'
 
-        # CWDにdir_inを圧縮対象のフォルダとして登録する。
-        os.chdir(dir_in)
+        # 7z.exeのCWDにdir_inを圧縮対象のフォルダとして登録する。
+        # os.chdir()はプロセス全体のCWDを変更してしまい、同時に複数の圧縮を実行できないので使わない。
+        self.cwd = dir_in
+        self.name = fn_out_wo_ext
+
+        # InProcessBackendが使うパラメータ
+        self.fp_out_wo_ext_abs = os.path.join(dir_out, fn_out_wo_ext)
+        self.archive_type = archive_type
+        self.volume_size = volume_size
+        self.pwd = pwd
+        self.recurse = recurse
 
         # 拡張子無しの圧縮ファイルの絶対パス。
-        self.fp_out_wo_ext = enclose(os.path.join(dir_out, fn_out_wo_ext))
+        self.fp_out_wo_ext = self.fp_out_wo_ext_abs
 
         # 圧縮対象ファイルのフィルタのワイルドカード表現
-        # スペースが複数の表現をORで繋ぐので、本表現はクオートで括ってはいけない。
+        # スペースが複数の表現をORで繋ぐので、スペースで分けて別々の引数にする。
         # https://sevenzip.osdn.jp/chm/cmdline/syntax.htm
         self.flt_exp = flt_exp
 
@@ -185,18 +308,25 @@ class Add(Command):
         # パラメータのリストを構築
         self.prm_lst.extend([
             # positional
-            self.cmd, self.fp_out_wo_ext, self.flt_exp,
+            self.cmd, self.fp_out_wo_ext, *split_flt_exp(self.flt_exp),
             # keyword
             self.t, self.p, self.m, self.r, self.v
         ])
 
+        # バックエンドが対応していない設定は、実行前に例外にする。
+        self.backend.validate(self)
+
+    # 圧縮対象のフォルダのファイルサイズの合計
+    def get_total_size(self):
+        return sum(entry.size for entry in hpath.Dir(self.cwd).scan())
+
 
 class Extract(Command):
     # ExtractWithFullPath
     def __init__(self,
                  fp_in, dir_out,
                  flt_exp='*', archive_type='7z', split=True,
-                 pwd=DFT_PWD, recurse=True):
+                 pwd=DFT_PWD, recurse=True, backend=None):
         """ Constructor
         ----------- 必須 -----------
         :param fp_in:　圧縮ファイル。
@@ -207,22 +337,31 @@ class Extract(Command):
         :param archive_type: 「zip」にしたら機能が減るので、基本的に「7z」だけしか使わないようにしたい。
         :param pwd: パスワード
         :param recurse: 再帰検索のフラグ。
+        :param backend: ExternalBackendもしくはInProcessBackend。Noneの場合はget_default_backend()
         """
-        super().__init__()
+        super().__init__(backend=backend)
 
         # 相対パスを保持する解凍コマンド
         # https://sevenzip.osdn.jp/chm/cmdline/commands/extract_full.htm
         self.cmd = 'x'
 
+        self.name = os.path.basename(fp_in)
+
+        # InProcessBackendが使うパラメータ
+        self.fp_in_abs = fp_in
+        self.dir_out_abs = dir_out
+        self.pwd = pwd
+        self.recurse = recurse
+
         # 圧縮ファイルの絶対パス
         # ファイルが分割されている場合は、一つ目の圧縮ファイル「ファイル名.7z.001」をえらばなくてはいけない。
-        self.fp_in = enclose(fp_in)
+        self.fp_in = fp_in
 
         # 解凍ファイルの出力先フォルダ
-        self.dir_out = '-o' + enclose(dir_out)
+        self.dir_out = '-o' + dir_out
 
         # 解凍対象ファイルのフィルタのワイルドカード表現
-        # スペースが複数の表現をORで繋ぐので、本表現は「"」で括ってはいけない。
+        # スペースが複数の表現をORで繋ぐので、スペースで分けて別々の引数にする。
         # https://sevenzip.osdn.jp/chm/cmdline/syntax.htm
         self.flt_exp = flt_exp
 
@@ -249,11 +388,616 @@ class Extract(Command):
         # パラメータのリストを構築
         self.prm_lst.extend([
             # positional
-            self.cmd, self.fp_in, self.dir_out, self.flt_exp,
+            self.cmd, self.fp_in, self.dir_out, *split_flt_exp(self.flt_exp),
             # keyword
             self.t, self.p, self.r
         ])
 
+        # バックエンドが対応していない設定は、実行前に例外にする。
+        self.backend.validate(self)
+
+    # 圧縮ファイルのサイズ(展開後のサイズではないので、MB/sは圧縮ファイルの読み込み速度になる)
+    # 分割されている場合は、全てのファイルのサイズの合計
+    def get_total_size(self):
+        return sum(os.path.getsize(fp) for fp in get_volume_paths(self.fp_in_abs))
+
+
+# Runnerの実行結果
+JobResult = collections.namedtuple('JobResult', ['name', 'return_code', 'description', 'seconds', 'output'])
+
+# 実行中の進捗
+# bytes_doneは、パーセントと処理するバイト数の見積もりから計算する。見積もりが無い場合はNone
+# mb_per_secは直近RATE_WINDOW秒の平均、etaは残りの秒数。計算できない場合はNone
+Progress = collections.namedtuple('Progress', ['name', 'percent', 'files', 'current_file',
+                                               'bytes_done', 'bytes_total', 'mb_per_sec', 'eta'])
+
+
+class Rate:
+    """直近の一定期間のMB/s"""
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.samples = collections.deque()
+
+    def add(self, t, size):
+        self.samples.append((t, size))
+        while len(self.samples) > 2 and t - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    @property
+    def mb_per_sec(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, s0), (t1, s1) = self.samples[0], self.samples[-1]
+        if t1 <= t0:
+            return None
+        return (s1 - s0) / (t1 - t0) / 1024 ** 2
+
+
+class ProgressParser:
+    """7z.exeの出力を受けて、進捗の行と、それ以外の行に分ける。"""
+    def __init__(self):
+        self.buf = ''
+        # 進捗以外の出力の行
+        self.lines = []
+
+    def feed(self, text):
+        """ 出力の断片を受けて、(パーセント, ファイル数, 現在のファイル)のリストを返す。
+        7z.exeは、進捗の行をバックスペースで消して上書きするので、バックスペースと改行で区切る。
+        """
+        self.buf += text
+        *tokens, self.buf = re.split(r'[\b\r\n]+', self.buf)
+        updates = []
+        for token in tokens:
+            m = RGX_PROGRESS.match(token)
+            if m:
+                files = int(m.group(2)) if m.group(2) else None
+                updates.append((int(m.group(1)), files, (m.group(3) or '').strip()))
+            elif token.strip():
+                self.lines.append(token)
+        return updates
+
+
+# 進捗を一行で表示する。execute_streaming()のon_progressの既定値
+def print_progress(progress):
+    mb_per_sec = f'{progress.mb_per_sec:.1f} MB/s' if progress.mb_per_sec is not None else '-- MB/s'
+    eta = f'ETA {progress.eta:.0f} s' if progress.eta is not None else 'ETA --'
+    print(f'\r{progress.percent:3d}% {mb_per_sec} {eta} {progress.current_file[-40:]:<40}', end='')
+
+
+def execute_streaming(cmd, on_progress=print_progress, total_size=None, fp_metrics=FP_METRICS):
+    """ 進捗を受けながら7z.exeを実行する。
+    :param cmd: Command
+    :param on_progress: Progressを受ける関数。Noneの場合は何もしない。
+    :param total_size: 処理するバイト数の見積もり。Noneの場合はcmd.get_total_size()
+    :param fp_metrics: 実行時間を追記するファイル。Noneの場合は記録しない。
+    :return: JobResult
+    """
+    if total_size is None:
+        total_size = cmd.get_total_size()
+    statement = cmd.construct_args() + PROGRESS_SWITCHES
+
+    parser = ProgressParser()
+    rate = Rate()
+    time_start = time.perf_counter()
+    dt_start = datetime.datetime.now()
+    proc = subprocess.Popen(statement, cwd=cmd.cwd,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    with proc:
+        while True:
+            chunk = proc.stdout.read1(4096)
+            if not chunk:
+                break
+            for percent, files, current_file in parser.feed(chunk.decode(errors='ignore')):
+                now = time.perf_counter()
+                bytes_done = total_size * percent // 100 if total_size else None
+                mb_per_sec, eta = None, None
+                if bytes_done is not None:
+                    rate.add(now, bytes_done)
+                    mb_per_sec = rate.mb_per_sec
+                    if mb_per_sec:
+                        eta = (total_size - bytes_done) / 1024 ** 2 / mb_per_sec
+                if on_progress is not None:
+                    on_progress(Progress(name=cmd.name, percent=percent, files=files, current_file=current_file,
+                                         bytes_done=bytes_done, bytes_total=total_size,
+                                         mb_per_sec=mb_per_sec, eta=eta))
+    return_code = proc.returncode
+    seconds = time.perf_counter() - time_start
+    result = JobResult(name=cmd.name, return_code=return_code, description=get_description(return_code),
+                       seconds=seconds, output='\n'.join(parser.lines))
+
+    if fp_metrics is not None:
+        write_metrics(fp_metrics, cmd, result, dt_start, total_size)
+    return result
+
+
+def write_metrics(fp_metrics, cmd, result, dt_start, total_size):
+    """ 実行時間をJSON Linesで追記する。容量計画用。
+    パスワードが含まれるので、ステートメントは記録しない。
+    """
+    record = {'name': result.name,
+              'command': cmd.cmd,
+              'backend': type(cmd.backend).__name__,
+              'cwd': cmd.cwd,
+              'start': dt_start.isoformat(timespec='seconds'),
+              'seconds': round(result.seconds, 3),
+              'bytes_total': total_size,
+              'mb_per_sec': round(total_size / 1024 ** 2 / result.seconds, 3) if total_size and result.seconds else None,
+              'return_code': result.return_code}
+    os.makedirs(os.path.dirname(fp_metrics), exist_ok=True)
+    with open(fp_metrics, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class Test(Command):
+    # 圧縮ファイルを解凍せずに、CRCを確認する。
+    # https://sevenzip.osdn.jp/chm/cmdline/commands/test.htm
+    def __init__(self, fp_in, pwd=DFT_PWD, backend=None):
+        """ Constructor
+        :param fp_in: 圧縮ファイル。分割されている場合は「ファイル名.7z.001」
+        :param pwd: パスワード
+        :param backend: ExternalBackendもしくはInProcessBackend。Noneの場合はget_default_backend()
+        """
+        super().__init__(backend=backend)
+        self.cmd = 't'
+        self.name = os.path.basename(fp_in)
+        self.fp_in_abs = fp_in
+        self.fp_in = fp_in
+        self.pwd = pwd
+        self.p = f'-p{pwd}' if is_str(pwd) else None
+        self.prm_lst.extend([self.cmd, self.fp_in, self.p])
+        self.backend.validate(self)
+
+    def get_total_size(self):
+        return sum(os.path.getsize(fp) for fp in get_volume_paths(self.fp_in_abs))
+
+
+class List(Command):
+    # 圧縮ファイルの中身を技術情報の形式(-slt)で一覧にする。
+    # https://sevenzip.osdn.jp/chm/cmdline/commands/list.htm
+    def __init__(self, fp_in, pwd=None, backend=None):
+        """ Constructor
+        :param fp_in: 圧縮ファイル。分割されている場合は「ファイル名.7z.001」
+        :param pwd: パスワード。ヘッダーが暗号化されている場合は必要
+        :param backend: ExternalBackendだけ対応している。Noneの場合はget_default_backend()
+        """
+        super().__init__(backend=backend)
+        self.cmd = 'l'
+        self.name = os.path.basename(fp_in)
+        self.fp_in_abs = fp_in
+        self.fp_in = fp_in
+
+        # パスワード
+        # 暗号化されていてパスワードが無い場合、標準入力を閉じて実行するので、入力待ちで止まらずにエラーになる。
+        # 注意：7z.exeの他のコマンドと同じく「-p」で引数に渡すので、実行中は同じPCの他のユーザーからも
+        # プロセスの一覧(ps、タスクマネージャー等)で見える。
+        self.p = f'-p{pwd}' if is_str(pwd) else None
+
+        # 出力の文字コードをUTF-8にする。
+        # https://sevenzip.osdn.jp/chm/cmdline/switches/charset.htm
+        self.prm_lst.extend([self.cmd, self.fp_in, '-slt', '-sccUTF-8', self.p])
+
+        if not isinstance(self.backend, ExternalBackend):
+            raise ValueError(f'{self.name}: listing requires 7z.exe.')
+
+    def get_total_size(self):
+        return sum(os.path.getsize(fp) for fp in get_volume_paths(self.fp_in_abs))
+
+    # 実行して、(リターンコード, 標準出力)を返す。
+    def capture(self):
+        ret = subprocess.run(self.construct_args(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             stdin=subprocess.DEVNULL)
+        return ret.returncode, ret.stdout.decode('utf-8', errors='replace')
+
+
+# 分割された圧縮ファイルのパスのリスト
+# 「.001」で終わる場合は、「.002」「.003」…と続くファイルを集める。それ以外は、そのファイルだけ。
+def get_volume_paths(fp_in):
+    if not fp_in.endswith('.001'):
+        return [fp_in]
+    fp_base = fp_in[:-4]
+    fp_lst = []
+    i = 1
+    while os.path.isfile(f'{fp_base}.{i:03d}'):
+        fp_lst.append(f'{fp_base}.{i:03d}')
+        i += 1
+    return fp_lst
+
+
+class VolumeWriter(io.RawIOBase):
+    """ 書き込んだバイト列を、一定のサイズ毎に「.001」「.002」…のファイルに分割する。
+    シークできないので、zipfileはデータディスクリプタを使って書き込む(tarfileはストリームモードで使う)。
+    """
+    def __init__(self, fp_base, volume_size=None):
+        """ Constructor
+        :param fp_base: 分割番号無しのファイルパス
+        :param volume_size: 一つのファイルのバイト数。Noneの場合は分割せずにfp_baseに書き込む。
+        """
+        super().__init__()
+        self.fp_base = fp_base
+        self.volume_size = volume_size
+        self.fp_lst = []
+        self._f = None
+        self._remain = 0
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _next_volume(self):
+        if self._f is not None:
+            self._f.close()
+        if self.volume_size is None:
+            fp = self.fp_base
+            self._remain = float('inf')
+        else:
+            fp = f'{self.fp_base}.{len(self.fp_lst) + 1:03d}'
+            self._remain = self.volume_size
+        self.fp_lst.append(fp)
+        self._f = open(fp, 'wb')
+
+    def write(self, b):
+        mv = memoryview(b).cast('B')
+        n = len(mv)
+        while len(mv) > 0:
+            if self._f is None or self._remain == 0:
+                self._next_volume()
+            k = min(self._remain, len(mv))
+            self._f.write(mv[:k])
+            mv = mv[k:]
+            self._remain -= k
+            self._pos += k
+        return n
+
+    def close(self):
+        if not self.closed:
+            # 何も書き込まれなかった場合も、ファイルを一つ作る。
+            if self._f is None:
+                self._next_volume()
+            self._f.close()
+        super().close()
+
+
+class VolumeReader(io.RawIOBase):
+    """分割されたファイルを、シークできる一つのファイルとして読み込む。"""
+    def __init__(self, fp_lst):
+        super().__init__()
+        self.fp_lst = fp_lst
+        # 各ファイルの先頭の位置
+        self.offsets = [0]
+        for fp in fp_lst:
+            self.offsets.append(self.offsets[-1] + os.path.getsize(fp))
+        self.size = self.offsets[-1]
+        self._pos = 0
+        self._i = None
+        self._f = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError('negative seek position')
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+        i = bisect.bisect_right(self.offsets, self._pos) - 1
+        if i != self._i:
+            if self._f is not None:
+                self._f.close()
+            self._f = open(self.fp_lst[i], 'rb')
+            self._i = i
+        self._f.seek(self._pos - self.offsets[i])
+        n = self._f.readinto(memoryview(b)[:self.offsets[i + 1] - self._pos])
+        self._pos += n
+        return n
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+        super().close()
+
+
+class ExternalBackend:
+    """7z.exeを実行するバックエンド"""
+    def __init__(self, fp_exe=None):
+        """ Constructor
+        :param fp_exe: 7z.exeのパス。Noneの場合はfind_exe()
+        """
+        self.fp_exe = fp_exe if fp_exe else find_exe()
+
+        # アプリケーション「7z.exe」が見つからなかったら例外
+        if self.fp_exe is None or not os.path.isfile(self.fp_exe):
+            raise ValueError(f'7z.exe was not found at {self.fp_exe or FP_EXE}')
+
+        # Windowsの場合、ライブラリ「7z.dll」が見つからなかったら例外
+        fp_dll = os.path.join(os.path.dirname(self.fp_exe), '7z.dll')
+        if os.name == 'nt' and not os.path.isfile(fp_dll):
+            raise ValueError(f'7z.dll was not found at {fp_dll}')
+
+    # 7z.exeは全ての設定に対応している。
+    def validate(self, cmd):
+        pass
+
+    def execute(self, cmd):
+        return execute_statement(cmd.construct_args(), cwd=cmd.cwd)
+
+    def run(self, cmd, on_progress=None, fp_metrics=None):
+        return execute_streaming(cmd, on_progress=on_progress, fp_metrics=fp_metrics)
+
+
+class InProcessBackend:
+    """zipfile/tarfile/lzmaで、このプロセスの中で圧縮・解凍するバックエンド"""
+    # 暗号化には対応していないので、圧縮でパスワードを指定したら例外
+    # 解凍の場合、ZIPの従来の暗号化(ZipCrypto)だけは読み込める。
+    def validate(self, cmd):
+        if cmd.cmd == 'a':
+            if is_str(cmd.pwd):
+                raise ValueError(f'{cmd.name}: in-process backend can not encrypt. Set pwd=None or use 7z.exe.')
+            if cmd.archive_type not in IN_PROCESS_TYPES:
+                raise ValueError(f'{cmd.name}: archive type "{cmd.archive_type}" is not supported in-process.')
+            parse_volume_size(cmd.volume_size)
+
+    def execute(self, cmd):
+        result = self.run(cmd)
+        print(f'returned code: {result.return_code}, description: {result.description}')
+        return result.return_code
+
+    def run(self, cmd, on_progress=None, fp_metrics=None):
+        """execute_streaming()と同じように、JobResultを返す。"""
+        total_size = cmd.get_total_size()
+        reporter = _ProgressReporter(cmd.name, total_size, on_progress)
+        time_start = time.perf_counter()
+        dt_start = datetime.datetime.now()
+        try:
+            if cmd.cmd == 'a':
+                output = self._add(cmd, reporter)
+            elif cmd.cmd == 'x':
+                output = self._extract(cmd, reporter)
+            elif cmd.cmd == 't':
+                output = self._test(cmd, reporter)
+            else:
+                raise ValueError(f'command "{cmd.cmd}" is not supported in-process.')
+            return_code = ErrorCode.NO_ERROR
+        except (OSError, ValueError, RuntimeError, zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError) as e:
+            output = f'ERROR: {e}'
+            return_code = ErrorCode.FATAL_ERROR
+        result = JobResult(name=cmd.name, return_code=int(return_code), description=get_description(return_code),
+                           seconds=time.perf_counter() - time_start, output=output)
+        if fp_metrics is not None:
+            write_metrics(fp_metrics, cmd, result, dt_start, total_size)
+        return result
+
+    # 圧縮対象のファイルを(ファイルパス, arcname, サイズ)で返す。
+    # 7z.exeと同じように、flt_expは空白区切りのワイルドカードで、ファイル名称に合致させる。
+    @staticmethod
+    def _yield_members(cmd):
+        pattern_lst = cmd.flt_exp.split() if is_str(cmd.flt_exp) else ['*']
+        prefix = cmd.cwd.rstrip('\\/') + os.sep
+        for entry in hpath.Dir(cmd.cwd).scan(recursive=cmd.recurse):
+            if any(fnmatch.fnmatch(entry.base_name, pattern) for pattern in pattern_lst):
+                yield entry.path, entry.path[len(prefix):], entry.size
+
+    def _add(self, cmd, reporter):
+        ext, mode = IN_PROCESS_TYPES[cmd.archive_type]
+        member_lst = list(self._yield_members(cmd))
+        with VolumeWriter(cmd.fp_out_wo_ext_abs + ext, parse_volume_size(cmd.volume_size)) as writer:
+            if ext == '.zip':
+                with zipfile.ZipFile(writer, 'w', compression=mode) as zf:
+                    for fp, arcname, size in member_lst:
+                        # 圧縮できないファイルは無圧縮で格納する。
+                        compress_type = zipfile.ZIP_STORED if hzip.is_incompressible(fp, size) else mode
+                        zf.write(fp, arcname=arcname, compress_type=compress_type)
+                        reporter.add(size, arcname)
+            else:
+                with tarfile.open(fileobj=writer, mode=mode) as tf:
+                    for fp, arcname, size in member_lst:
+                        tf.add(fp, arcname=arcname.replace(os.sep, '/'), recursive=False)
+                        reporter.add(size, arcname)
+        return f'{len(member_lst)} files -> ' + ', '.join(os.path.basename(fp) for fp in writer.fp_lst)
+
+    def _extract(self, cmd, reporter):
+        pattern_lst = cmd.flt_exp.split() if is_str(cmd.flt_exp) else ['*']
+
+        def is_target(name):
+            base_name = name.rstrip('/').rsplit('/', 1)[-1]
+            return any(fnmatch.fnmatch(base_name, pattern) for pattern in pattern_lst)
+
+        count = 0
+        with io.BufferedReader(VolumeReader(get_volume_paths(cmd.fp_in_abs)), IN_PROCESS_CHUNK_SIZE) as reader:
+            if reader.peek(len(SIGNATURE_7Z)).startswith(SIGNATURE_7Z):
+                raise ValueError('7z format can not be extracted in-process. Use 7z.exe.')
+            if zipfile.is_zipfile(reader):
+                with zipfile.ZipFile(reader) as zf:
+                    if is_str(cmd.pwd):
+                        zf.setpassword(cmd.pwd.encode())
+                    for info in zf.infolist():
+                        if info.is_dir() or is_target(info.filename):
+                            zf.extract(info, cmd.dir_out_abs)
+                            count += not info.is_dir()
+                        reporter.add(info.compress_size, info.filename)
+            else:
+                reader.seek(0)
+                with tarfile.open(fileobj=reader, mode='r:*') as tf:
+                    for info in tf:
+                        if info.isdir() or is_target(info.name):
+                            # 出力先フォルダの外に書き込むメンバーは拒否する。
+                            if hasattr(tarfile, 'data_filter'):
+                                tf.extract(info, cmd.dir_out_abs, filter='data')
+                            else:
+                                tf.extract(info, cmd.dir_out_abs)
+                            count += not info.isdir()
+                        reporter.add(info.size, info.name)
+        return f'{count} files extracted.'
+
+    # 全てのメンバーを読み込んで、CRC(zip)と圧縮データ(tar.xz等)を確認する。
+    def _test(self, cmd, reporter):
+        count = 0
+        with io.BufferedReader(VolumeReader(get_volume_paths(cmd.fp_in_abs)), IN_PROCESS_CHUNK_SIZE) as reader:
+            if reader.peek(len(SIGNATURE_7Z)).startswith(SIGNATURE_7Z):
+                raise ValueError('7z format can not be tested in-process. Use 7z.exe.')
+            if zipfile.is_zipfile(reader):
+                with zipfile.ZipFile(reader) as zf:
+                    if is_str(cmd.pwd):
+                        zf.setpassword(cmd.pwd.encode())
+                    for info in zf.infolist():
+                        # 読み終わった時にCRCが合わなければBadZipFile
+                        with zf.open(info) as f:
+                            while f.read(IN_PROCESS_CHUNK_SIZE):
+                                pass
+                        count += 1
+                        reporter.add(info.compress_size, info.filename)
+            else:
+                reader.seek(0)
+                with tarfile.open(fileobj=reader, mode='r:*') as tf:
+                    for info in tf:
+                        if info.isfile():
+                            f = tf.extractfile(info)
+                            while f.read(IN_PROCESS_CHUNK_SIZE):
+                                pass
+                        count += 1
+                        reporter.add(info.size, info.name)
+        return f'{count} members tested.'
+
+
+class _ProgressReporter:
+    """InProcessBackendの進捗を、execute_streaming()と同じProgressで返す。"""
+    def __init__(self, name, total_size, on_progress):
+        self.name = name
+        self.total_size = total_size
+        self.on_progress = on_progress
+        self.rate = Rate()
+        self.files = 0
+        self.bytes_done = 0
+
+    def add(self, size, current_file):
+        self.files += 1
+        self.bytes_done += size
+        if self.on_progress is None:
+            return
+        bytes_done = min(self.bytes_done, self.total_size) if self.total_size else self.bytes_done
+        percent = bytes_done * 100 // self.total_size if self.total_size else 0
+        self.rate.add(time.perf_counter(), bytes_done)
+        mb_per_sec = self.rate.mb_per_sec
+        eta = (self.total_size - bytes_done) / 1024 ** 2 / mb_per_sec if mb_per_sec and self.total_size else None
+        self.on_progress(Progress(name=self.name, percent=percent, files=self.files, current_file=current_file,
+                                  bytes_done=bytes_done, bytes_total=self.total_size,
+                                  mb_per_sec=mb_per_sec, eta=eta))
+
+
+# 7z.exeを探す。
+# 環境変数「SENDTO_7Z_EXE」、既定のインストール先、PATHの「7z」「7za」の順番
+def find_exe():
+    fp_exe = os.getenv(ENV_EXE)
+    if fp_exe:
+        return fp_exe
+    if os.path.isfile(FP_EXE):
+        return FP_EXE
+    return shutil.which('7z') or shutil.which('7za')
+
+
+# 7z.exeが見つかればExternalBackend、見つからなければInProcessBackend
+def get_default_backend():
+    fp_exe = find_exe()
+    if fp_exe:
+        return ExternalBackend(fp_exe)
+    return InProcessBackend()
+
+
+class Runner:
+    """複数の7z.exeを同時に実行する。"""
+    def __init__(self, workers=4, cpu_budget=None, fp_metrics=FP_METRICS):
+        """ Constructor
+        :param workers: 同時に実行する7z.exeの数
+        :param cpu_budget: 全体で使うスレッド数。圧縮の7z.exeには「-mmt」で均等に割り振る。Noneの場合はCPU数
+        :param fp_metrics: 実行時間を追記するファイル。Noneの場合は記録しない。
+        """
+        self.workers = workers
+        self.cpu_budget = cpu_budget if cpu_budget else os.cpu_count()
+        self.fp_metrics = fp_metrics
+        # 実行中のコマンドの進捗
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._time_print = 0
+
+    @property
+    def threads_per_job(self):
+        return max(1, self.cpu_budget // self.workers)
+
+    # 実行中のコマンドの進捗をまとめて一行で表示する。
+    def _on_progress(self, progress):
+        with self._lock:
+            self._progress[progress.name] = progress
+            now = time.perf_counter()
+            if now - self._time_print < PROGRESS_INTERVAL:
+                return
+            self._time_print = now
+            mb_per_sec = sum(p.mb_per_sec or 0 for p in self._progress.values())
+            percent = ' '.join(f'{p.percent}%' for p in self._progress.values())
+            print(f'\rrunning: {percent} total {mb_per_sec:.1f} MB/s', end='')
+
+    # 一つのコマンドを実行する。スレッドで実行される。
+    # 同時に実行した7z.exeの出力が混ざらないように、出力は取得しておく。
+    def _run(self, cmd):
+        try:
+            return cmd.backend.run(cmd, on_progress=self._on_progress, fp_metrics=self.fp_metrics)
+        finally:
+            with self._lock:
+                self._progress.pop(cmd.name, None)
+
+    def run(self, cmd_lst):
+        """ コマンドを同時に実行して、JobResultのリスト(cmd_lstと同じ順番)を返す。
+        :param cmd_lst: Commandのリスト
+        """
+        # 「-mmt」は圧縮のスレッド数なので、解凍・テスト・一覧のコマンドには付けない。
+        threads = self.threads_per_job
+        for cmd in cmd_lst:
+            if cmd.uses_threads:
+                cmd.set_threads(threads)
+
+        result_lst = [None] * len(cmd_lst)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            future_dict = {pool.submit(self._run, cmd): i for i, cmd in enumerate(cmd_lst)}
+            for future in concurrent.futures.as_completed(future_dict):
+                i = future_dict[future]
+                try:
+                    result = future.result()
+                except OSError as e:
+                    result = JobResult(name=cmd_lst[i].name, return_code=None, description=str(e),
+                                       seconds=0.0, output='')
+                print(f'\r{result.name}: returned code: {result.return_code}, description: {result.description}, '
+                      f'{result.seconds:.1f} s')
+                result_lst[i] = result
+        return result_lst
+
+
+def print_summary(result_lst):
+    # エラーコード毎の件数
+    counter = collections.Counter(r.description for r in result_lst)
+    print('=== 7z Result ===')
+    for description, count in counter.most_common():
+        print(f'\t{description}: {count}')
+    # 失敗したコマンドの出力の最後の数行を表示する。
+    for r in result_lst:
+        if r.return_code != ErrorCode.NO_ERROR:
+            print(f'--- {r.name} ({r.description}) ---')
+            print('\n'.join(r.output.strip().splitlines()[-5:]))
+
 
 def main():
     import argparse
@@ -270,22 +1014,36 @@ def main():
     parser.add_argument('-f', '--flt_exp', type=str, help='Filter Wild Card')
     parser.set_defaults(flt_exp='*')
 
+    parser.add_argument('-b', '--backend', type=str, choices=['auto', 'exe', 'python'], help='Backend')
+    parser.set_defaults(backend='auto')
+    parser.add_argument('-e', '--exe', type=str, help='Path to 7z.exe')
+
     args = parser.parse_args()
 
+    backend = None
+    if args.backend == 'exe' or args.exe:
+        backend = ExternalBackend(args.exe)
+    elif args.backend == 'python':
+        backend = InProcessBackend()
+
     obj = None
     if args.cmd == 'a':
         obj = Add(dir_in=args.dir_in,
                   dir_out=args.dir_out,
                   fn_out_wo_ext=args.fn_out,
+                  pwd=None if isinstance(backend, InProcessBackend) else DFT_PWD,
+                  backend=backend,
                   )
     elif args.cmd == 'x':
         obj = Extract(fp_in=args.fp_in,
                       dir_out=args.dir_out,
                       flt_exp=args.flt_exp,
+                      backend=backend,
                       )
 
     if obj:
-        execute_statement(obj.construct_statement())
+        result = execute_streaming(obj)
+        print(f'\nreturned code: {result.return_code}, description: {result.description}, {result.seconds:.1f} s')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+"""
+Result Cache
+ファイル毎の解析結果を、(パス, サイズ, 更新日時, クエリ)をキーにしてSQLiteファイルに保存する。
+
+■　使い方
+    ResultCache.map()は、hxml.map_files()と同じように(キー, 結果)を入力の順番で返す。
+    サイズと更新日時が前回と同じファイルは、保存されている結果を返し、変わったファイルだけを解析する。
+    クエリは、解析の内容を表す文字列(例：「tags」「xpath://item」)。解析の内容が違えば、別の結果として保存する。
+
+■　削除
+    使われた日時を記録しておき、行数がmax_rowsを超えたら、古いものから削除する(LRU)。
+
+■　注意
+    結果はJSONで保存するので、辞書・リスト・数値・文字列・None以外は保存できない。
+"""
+import os
+import json
+import time
+import sqlite3
+import collections
+
+try:
+    from hlib import hidx
+    from hlib import hxml
+except ImportError:
+    try:
+        import hidx
+        import hxml
+    except ImportError:
+        print('import hidx failed')
+
+
+# キャッシュファイルの既定の保存先
+FP_CACHE = os.path.join(hidx.DIR_APP_CACHE, 'results.sqlite')
+
+# 保存する最大の行数
+MAX_ROWS = 2000000
+
+# コミットする間隔(ファイル数)
+COMMIT_INTERVAL = 1000
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS results (
+    path TEXT NOT NULL,
+    query TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    value TEXT,
+    used REAL,
+    PRIMARY KEY (path, query)
+);
+CREATE INDEX IF NOT EXISTS idx_used ON results (used);
+"""
+
+
+class ResultCache:
+    def __init__(self, fp_db=FP_CACHE, max_rows=MAX_ROWS):
+        """ Constructor
+        :param fp_db: キャッシュファイルのパス
+        :param max_rows: 保存する最大の行数
+        """
+        self.fp_db = fp_db
+        self.max_rows = max_rows
+        os.makedirs(os.path.dirname(self.fp_db), exist_ok=True)
+        self.con = sqlite3.connect(self.fp_db)
+        self.con.executescript(SQL_CREATE)
+        # 使われた日時を更新する(path, query)のリスト。書き込みをまとめる為に溜めておく。
+        self._touched = []
+        self.count_hit = 0
+        self.count_miss = 0
+
+    def close(self):
+        self.commit()
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, path, size, mtime, query):
+        """保存されている結果を(見つかったか？, 結果)で返す。サイズか更新日時が違う場合は見つからなかったことにする。"""
+        row = self.con.execute('SELECT size, mtime, value FROM results WHERE path = ? AND query = ?',
+                               (path, query)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return False, None
+        self._touched.append((time.time(), path, query))
+        return True, json.loads(row[2])
+
+    def put(self, path, size, mtime, query, value):
+        self.con.execute("""
+            INSERT INTO results (path, query, size, mtime, value, used) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path, query) DO UPDATE SET
+                size = excluded.size, mtime = excluded.mtime, value = excluded.value, used = excluded.used
+            """, (path, query, size, mtime, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def commit(self):
+        if self._touched:
+            self.con.executemany('UPDATE results SET used = ? WHERE path = ? AND query = ?', self._touched)
+            self._touched = []
+        self.con.commit()
+
+    # 行数がmax_rowsを超えたら、使われた日時が古いものから削除する。
+    def evict(self):
+        count = self.con.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        if count > self.max_rows:
+            self.con.execute('DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used LIMIT ?)',
+                             (count - self.max_rows,))
+            self.con.commit()
+        return max(0, count - self.max_rows)
+
+    def map(self, fnc, item_itr, query, workers=1):
+        """ hxml.map_files()に、キャッシュを挟んだジェネレータ
+        :param fnc: ファイルパスを受ける関数(hxml.map_files()を参照)
+        :param item_itr: (キー, ファイルパス)のイテラブル
+        :param query: 解析の内容を表す文字列
+        :param workers: プロセス数
+        :return: (キー, 結果)を入力の順番で返す。
+        """
+        # 入力の順番に並べた、見つかったか？
+        order = collections.deque()
+        # 解析するファイルの(パス, サイズ, 更新日時)
+        miss = collections.deque()
+
+        def lookup(key, fp):
+            try:
+                st = os.stat(fp)
+            except OSError:
+                # 解析する関数にエラー処理を任せる。
+                st = None
+            size, mtime = (st.st_size, st.st_mtime) if st else (None, None)
+            found, value = self.get(fp, size, mtime, query) if st else (False, None)
+            if found:
+                self.count_hit += 1
+            else:
+                self.count_miss += 1
+                miss.append((fp, size, mtime))
+            order.append(found)
+            return found, value
+
+        # map_files()は見つかった結果をすぐに返し、解析した結果と合わせて入力の順番で返す。
+        parsed = 0
+        for key, value in hxml.map_files(fnc, item_itr, workers, lookup=lookup):
+            if not order.popleft():
+                fp, size, mtime = miss.popleft()
+                if size is not None:
+                    self.put(fp, size, mtime, query, value)
+                parsed += 1
+                if parsed % COMMIT_INTERVAL == 0:
+                    self.commit()
+            yield key, value
+
+        self.commit()
+        self.evict()
+        print(f'\ncache: {self.count_hit} hits, {self.count_miss} parsed. ({self.fp_db})')
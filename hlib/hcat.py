@@ -0,0 +1,309 @@
+"""
+Catalog
+圧縮ファイル(7z・zip)の中身の一覧をSQLiteファイルに保存して、どの圧縮ファイルにどのファイルが入っているか？を検索する。
+
+■　一覧の取得
+    7z: 「7z l -slt」の出力を解析する。分割されている場合は「.7z.001」だけを読む。
+        パスワードは7zの引数「-p」で渡すので、一覧の取得中は他のユーザーからもプロセスの一覧で見える。
+    zip: セントラルディレクトリをzipfileで読む。解凍はしない。
+
+■　更新
+    圧縮ファイルのサイズと更新日時が前回と同じ場合は、一覧を取得し直さない。
+    無くなった圧縮ファイルの行は削除する。
+
+■　検索
+    メンバーのパスは「/」区切りで保存し、ワイルドカード(SQLiteのGLOB)で検索する。大文字・小文字を区別する。
+    「/」を含まないパターンは、任意の階層のファイル名称に合致する。
+    パターンのファイル名称の部分でbase_nameのインデックスを使えるので、「*/report_2023*.xml」のように
+    ファイル名称の先頭がワイルドカードでなければ、全件を走査しない。
+"""
+import os
+import re
+import time
+import sqlite3
+import zipfile
+import collections
+import concurrent.futures
+
+try:
+    from hlib import hpath
+    from hlib import hidx
+    from hlib import h7z
+except ImportError:
+    try:
+        import hpath
+        import hidx
+        import h7z
+    except ImportError:
+        print('import hpath failed')
+
+
+# カタログファイルの既定の保存先
+FP_CATALOG = os.path.join(hidx.DIR_APP_CACHE, 'catalog.sqlite')
+
+# 圧縮ファイル(分割されている場合は一つ目のファイル)
+RGX_ARCHIVE = re.compile(r'\.(7z|zip)(\.001)?$', re.IGNORECASE)
+
+# 「7z l -slt」の一覧の開始の行
+RGX_SLT_START = re.compile(r'^-{10,}\s*$')
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    err TEXT
+);
+CREATE TABLE IF NOT EXISTS members (
+    archive_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    base_name TEXT NOT NULL,
+    size INTEGER,
+    packed_size INTEGER,
+    crc INTEGER,
+    mtime TEXT,
+    is_dir INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_archive ON members (archive_id);
+CREATE INDEX IF NOT EXISTS idx_base_name ON members (base_name);
+"""
+
+# 圧縮ファイルの中の一つのファイル・フォルダ
+# nameは「/」区切りのパス、crcは整数(無い場合はNone)、mtimeは「YYYY-MM-DD HH:MM:SS」
+Member = collections.namedtuple('Member', ['name', 'size', 'packed_size', 'crc', 'mtime', 'is_dir'])
+
+# 検索結果
+Hit = collections.namedtuple('Hit', ['archive', 'name', 'size', 'crc', 'mtime'])
+
+
+def is_archive(path):
+    return RGX_ARCHIVE.search(path) is not None
+
+
+# 分割されている場合も含めた、圧縮ファイルのサイズと最新の更新日時
+def get_archive_stat(fp):
+    size = 0
+    mtime = 0.0
+    for fp_vol in h7z.get_volume_paths(fp):
+        st = os.stat(fp_vol)
+        size += st.st_size
+        mtime = max(mtime, st.st_mtime)
+    return size, mtime
+
+
+def _to_int(s):
+    try:
+        return int(s)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_slt(text):
+    """ 「7z l -slt」の出力からMemberのリストを返す。
+    一覧は「----------」の行の後に、「Path = ...」で始まるブロックが空行区切りで並ぶ。
+    """
+    member_lst = []
+    started = False
+    block = {}
+    for line in text.splitlines() + ['']:
+        if not started:
+            started = RGX_SLT_START.match(line) is not None
+            continue
+        if line.strip() == '':
+            if 'Path' in block:
+                crc = block.get('CRC')
+                member_lst.append(Member(
+                    name=block['Path'].replace('\\', '/'),
+                    size=_to_int(block.get('Size')),
+                    packed_size=_to_int(block.get('Packed Size')),
+                    crc=int(crc, 16) if crc else None,
+                    mtime=block.get('Modified', '')[:19] or None,
+                    is_dir=block.get('Folder') == '+' or block.get('Attributes', '').startswith('D')))
+            block = {}
+            continue
+        key, sep, value = line.partition(' = ')
+        if sep:
+            block[key.strip()] = value.strip()
+    return member_lst
+
+
+def list_zip(fp):
+    """zipのセントラルディレクトリからMemberのリストを返す。分割されている場合は繋げて読む。"""
+    with h7z.VolumeReader(h7z.get_volume_paths(fp)) as reader, zipfile.ZipFile(reader) as zf:
+        return [Member(name=info.filename.rstrip('/'),
+                       size=info.file_size,
+                       packed_size=info.compress_size,
+                       crc=info.CRC,
+                       mtime='{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(*info.date_time),
+                       is_dir=info.is_dir())
+                for info in zf.infolist()]
+
+
+def list_7z(fp, pwd=None):
+    ret, text = h7z.List(fp, pwd=pwd).capture()
+    if ret != h7z.ErrorCode.NO_ERROR:
+        lines = [line for line in text.splitlines() if line.strip()]
+        raise ValueError(f'7z returned {ret}: ' + (lines[-1] if lines else h7z.get_description(ret)))
+    return parse_slt(text)
+
+
+# 「.7z」「.7z.001」「.zip」を除いた圧縮ファイルの名称
+def get_archive_stem(fp):
+    return RGX_ARCHIVE.sub('', os.path.basename(fp))
+
+
+# sendtocli.Cli.seven()で作った圧縮ファイルは、拡張子無しの名称がパスワードになっている。
+def get_pwd_from_name(fp):
+    return get_archive_stem(fp)
+
+
+# 圧縮ファイルの種類('7z'もしくは'zip')
+def get_archive_type(fp):
+    return RGX_ARCHIVE.search(fp).group(1).lower()
+
+
+# 一つの圧縮ファイルの一覧を取得する。スレッドで実行される。
+# 戻り値は(Memberのリスト, エラーメッセージ)
+def _list_archive(fp, pwd):
+    try:
+        if get_archive_type(fp) == 'zip':
+            return list_zip(fp), None
+        return list_7z(fp, pwd), None
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        return [], str(e)
+
+
+# 「*/report_2023*.xml」から、ファイル名称の部分「report_2023*.xml」を取り出す。
+def _get_base_name_pattern(pattern):
+    return pattern.rstrip('/').rsplit('/', 1)[-1]
+
+
+class Catalog:
+    def __init__(self, fp_db=FP_CATALOG):
+        """ Constructor
+        :param fp_db: カタログファイルのパス
+        """
+        self.fp_db = fp_db
+        os.makedirs(os.path.dirname(self.fp_db), exist_ok=True)
+        self.con = sqlite3.connect(self.fp_db)
+        self.con.executescript(SQL_CREATE)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # 削除するフォルダ配下の行を範囲で指定する為のキー(hidx.Indexと同じ)
+    @staticmethod
+    def _range(path):
+        path = path.rstrip(os.sep)
+        return path + os.sep, path + chr(ord(os.sep) + 1)
+
+    def _delete(self, archive_id):
+        self.con.execute('DELETE FROM members WHERE archive_id = ?', (archive_id,))
+        self.con.execute('DELETE FROM archives WHERE id = ?', (archive_id,))
+
+    def _insert(self, fp, size, mtime, member_lst, err):
+        cur = self.con.execute('INSERT INTO archives (path, type, size, mtime, err) VALUES (?, ?, ?, ?, ?)',
+                               (fp, get_archive_type(fp), size, mtime, err))
+        archive_id = cur.lastrowid
+        self.con.executemany("""
+            INSERT INTO members (archive_id, name, base_name, size, packed_size, crc, mtime, is_dir)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, ((archive_id, m.name, m.name.rsplit('/', 1)[-1], m.size, m.packed_size, m.crc, m.mtime, m.is_dir)
+                  for m in member_lst))
+
+    def update(self, root, pwd_fnc=None, workers=4):
+        """ フォルダ配下の圧縮ファイルの一覧を、カタログに登録する。
+        :param root: 圧縮ファイルを探すフォルダ
+        :param pwd_fnc: 圧縮ファイルのパスからパスワードを返す関数。Noneの場合はパスワード無し
+        :param workers: 同時に一覧を取得する数
+        :return: 一覧を取得した数、前回の一覧を使った数、削除した数
+        """
+        root = os.path.abspath(root)
+        known = {path: (archive_id, size, mtime) for archive_id, path, size, mtime in self.con.execute(
+            'SELECT id, path, size, mtime FROM archives WHERE path > ? AND path < ?', self._range(root))}
+
+        # サイズか更新日時が変わった圧縮ファイルだけ、一覧を取得する。
+        todo = []
+        count_reused = 0
+        for entry in hpath.Dir(root).scan():
+            if not is_archive(entry.path):
+                continue
+            try:
+                size, mtime = get_archive_stat(entry.path)
+            except OSError:
+                continue
+            row = known.pop(entry.path, None)
+            if row is not None and row[1:] == (size, mtime):
+                count_reused += 1
+                continue
+            todo.append((entry.path, size, mtime, row[0] if row else None))
+
+        # 無くなった圧縮ファイルを削除する。
+        for archive_id, size, mtime in known.values():
+            self._delete(archive_id)
+
+        # 一覧の取得は同時に実行して、書き込みはこのスレッドで行う。
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            future_dict = {pool.submit(_list_archive, fp, pwd_fnc(fp) if pwd_fnc else None): (fp, size, mtime, i)
+                           for fp, size, mtime, i in todo}
+            for future in concurrent.futures.as_completed(future_dict):
+                fp, size, mtime, archive_id = future_dict[future]
+                member_lst, err = future.result()
+                if archive_id is not None:
+                    self._delete(archive_id)
+                self._insert(fp, size, mtime, member_lst, err)
+                if err:
+                    print(f'ERROR: {fp}. {err}')
+        self.con.commit()
+        print(f'catalog: listed {len(todo)} archives, reused {count_reused} archives, removed {len(known)} archives.')
+        return len(todo), count_reused, len(known)
+
+    def find(self, pattern, limit=None):
+        """ ワイルドカードに合致するメンバーをHitで返すジェネレータ
+        :param pattern: 「*/report_2023*.xml」のような、「/」区切りのパスのワイルドカード
+        :param limit: 最大件数。Noneの場合は全て
+        """
+        sql = """
+            SELECT a.path, m.name, m.size, m.crc, m.mtime FROM members m JOIN archives a ON a.id = m.archive_id
+            WHERE m.base_name GLOB ? AND m.name GLOB ? AND NOT m.is_dir
+            ORDER BY a.path, m.name
+            """
+        # 「/」を含まないパターンは、ファイル名称だけで比較する。
+        prm = [_get_base_name_pattern(pattern), pattern if '/' in pattern else '*']
+        if limit is not None:
+            sql += ' LIMIT ?'
+            prm.append(limit)
+        for row in self.con.execute(sql, prm):
+            yield Hit(*row)
+
+    # 一覧を取得できなかった圧縮ファイルの(パス, エラーメッセージ)のリスト
+    def get_errors(self):
+        return self.con.execute('SELECT path, err FROM archives WHERE err IS NOT NULL ORDER BY path').fetchall()
+
+
+def print_hits(catalog, pattern, limit=1000):
+    time_start = time.perf_counter()
+    hit_lst = list(catalog.find(pattern, limit=limit))
+    seconds = time.perf_counter() - time_start
+    for hit in hit_lst:
+        print(f'{hit.archive}: {hit.name} ({hit.size} bytes, {hit.mtime})')
+    print(f'{len(hit_lst)} hits in {seconds * 1000:.1f} ms' + (' (limit reached)' if len(hit_lst) == limit else ''))
+
+
+def _test():
+    import sys
+    with Catalog() as catalog:
+        catalog.update(sys.argv[1])
+        print_hits(catalog, sys.argv[2] if len(sys.argv) > 2 else '*')
+
+
+if __name__ == '__main__':
+    _test()
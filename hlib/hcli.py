@@ -14,6 +14,15 @@ def get_yes_no(msg='Question?'):
             print('Invalid Input.')
 
 
+def get_int(msg='Number', min_value=1):
+    while True:
+        s = input(f'"{msg}" (>={min_value}): ')
+        if s.isdigit() and int(s) >= min_value:
+            return int(s)
+        else:
+            print('Invalid Input.')
+
+
 def launch_prompt_loop(cmd_fnc={'hello': lambda: print('hello')},
                        prompt_symbol='>>> ',
                        err_msg='Command Not Defined...',
@@ -0,0 +1,503 @@
+"""
+Copy
+hpath.RelTplの相対フォルダ構造を保ちながら、ファイル・フォルダを複数のスレッドでコピーする。
+
+■　速くする工夫
+    NAS等へ小さいファイルを大量にコピーする場合は、ファイル毎の通信の待ち時間が支配的なので、複数のスレッドで待ち時間を重ねる。
+    作成済みのフォルダを覚えておき、ファイル毎にmakedirs()やisdir()を呼ばない。
+    ファイル毎に表示せず、まとめて進捗(files/s、MB/s)を表示する。
+
+■　同期モード
+    sync=Trueの場合は、出力先に同じファイルが既に存在したらコピーしない。
+    同じファイルか？は、サイズと更新日時で判定する。use_hash=Trueの場合は、サイズと中身のハッシュで判定する。
+    フォルダをコピーする場合も、既存の出力フォルダに上書きする。
+    出力先にだけ存在する余分なファイルは、find_extras()で探して、表示もしくは削除する。
+
+■　大きいファイル
+    LARGE_FILE_SIZE以上のファイルは、copy_large()でカーネル内でコピーする。使える方法を順番に試す。
+        1. reflink (Btrfs/XFS等でデータを複製せずに共有する。LinuxのFICLONE)
+        2. os.copy_file_range() (Linux)
+        3. os.sendfile() (Linux)
+        4. 大きいバッファでの読み書き
+    小さいファイルは、shutil.copy2()の方が準備が少ないので速い。
+
+■　ジャーナル (再開できるコピー)
+    Journalに、コピーする予定のRelTplの一覧と、完了したRelTplを記録する。
+    中断(ネットワークの瞬断やCtrl+C)した後に再実行すると、走査せずに、未完了のRelTplだけをコピーする。
+    atomic=Trueの場合は一時ファイル(*.sendto.part)に書き込んでから名称変更するので、書きかけのファイルが正しいファイルに見えることは無い。
+    一時ファイルの名称は書き込み毎に一意にするので、同じ出力ファイルに同時に書き込んでも衝突しない。失敗した場合は削除する。
+
+■　エラー
+    コピーに失敗しても止めずに、最後に失敗したファイルの一覧を返す。
+"""
+import os
+import time
+import shutil
+import hashlib
+import sys
+import sqlite3
+import tempfile
+import threading
+import collections
+import concurrent.futures
+
+try:
+    from hlib import hpath
+    from hlib import hidx
+except ImportError:
+    try:
+        import hpath
+        import hidx
+    except ImportError:
+        print('import hpath failed')
+
+# 進捗を表示する間隔(秒)
+PROGRESS_INTERVAL = 0.5
+
+# 更新日時を同じとみなす誤差(秒)
+# FATやSMBの一部は、更新日時の分解能が2秒なので、コピー後にずれる。
+MTIME_TOLERANCE = 2.0
+
+# ハッシュを計算する時の読み込みサイズ
+HASH_CHUNK_SIZE = 1024 ** 2
+
+# copy_large()を使うファイルサイズ
+LARGE_FILE_SIZE = 64 * 1024 ** 2
+
+# copy_large()の一回の転送サイズと、読み書きのバッファサイズ
+LARGE_CHUNK_SIZE = 64 * 1024 ** 2
+LARGE_BUFFER_SIZE = 8 * 1024 ** 2
+
+# LinuxのFICLONEのioctl番号 (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+# 一時ファイルの拡張子
+TMP_EXT = '.sendto.part'
+
+# ジャーナルファイルの保存先
+DIR_JOURNAL = os.path.join(hidx.DIR_APP_CACHE, 'journal')
+
+# ジャーナルをコミットする間隔(秒)
+JOURNAL_COMMIT_INTERVAL = 1.0
+
+# コピーの結果
+# failuresは、(入力パス, 例外)のリスト
+# skippedは、同期モードで同じファイルだったのでコピーしなかったファイル数
+Summary = collections.namedtuple('Summary', ['count', 'size', 'seconds', 'failures', 'skipped'], defaults=[0])
+
+
+class Progress:
+    """複数のスレッドから更新される進捗"""
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.count = 0
+        self.size = 0
+        self.skipped = 0
+        self.failed = 0
+        self.time_start = time.perf_counter()
+        self._time_print = 0
+        self._lock = threading.Lock()
+
+    def add(self, count, size, skipped=0, failed=0):
+        with self._lock:
+            self.count += count
+            self.size += size
+            self.skipped += skipped
+            self.failed += failed
+            # 表示は一定間隔ごと
+            now = time.perf_counter()
+            if now - self._time_print >= self.interval:
+                self._time_print = now
+                self.print()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.time_start
+
+    def print(self, end=''):
+        sec = max(self.seconds, 1e-9)
+        mb = self.size / 1024 ** 2
+        print(f'\r{self.count} files, {mb:.1f} MB, {self.count / sec:.1f} files/s, {mb / sec:.1f} MB/s, '
+              f'{self.skipped} skipped, {self.failed} failed', end=end)
+
+
+# ファイルの中身のハッシュ
+def get_hash(fp):
+    h = hashlib.sha1()
+    with open(fp, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+# reflinkでコピーする。対応していないファイルシステムの場合はOSError
+def _copy_reflink(fd_in, fd_out, size):
+    import fcntl
+    fcntl.ioctl(fd_out, FICLONE, fd_in)
+
+
+def _copy_file_range(fd_in, fd_out, size):
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(fd_in, fd_out, min(LARGE_CHUNK_SIZE, size - offset))
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def _copy_sendfile(fd_in, fd_out, size):
+    offset = 0
+    while offset < size:
+        n = os.sendfile(fd_out, fd_in, offset, min(LARGE_CHUNK_SIZE, size - offset))
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+# 大きいバッファで読み書きする。どの環境でも使える。
+def _copy_buffer(f_in, f_out):
+    buf = bytearray(LARGE_BUFFER_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = f_in.readinto(buf)
+        if n == 0:
+            break
+        f_out.write(view[:n])
+
+
+# 使える方法の一覧(順番に試す)
+_KERNEL_COPY_FNC_LST = []
+if sys.platform.startswith('linux'):
+    _KERNEL_COPY_FNC_LST.append(_copy_reflink)
+if hasattr(os, 'copy_file_range'):
+    _KERNEL_COPY_FNC_LST.append(_copy_file_range)
+if sys.platform.startswith('linux') and hasattr(os, 'sendfile'):
+    _KERNEL_COPY_FNC_LST.append(_copy_sendfile)
+
+
+def copy_large(src_abs, dst_abs):
+    """ 大きいファイルをカーネル内でコピーして、メタデータもコピーする(shutil.copy2()と同じ)。
+    カーネル内のコピーが使えない場合は、大きいバッファでの読み書きにする。
+    """
+    with open(src_abs, 'rb') as f_in, open(dst_abs, 'wb') as f_out:
+        fd_in, fd_out = f_in.fileno(), f_out.fileno()
+        size = os.fstat(fd_in).st_size
+        for fnc in _KERNEL_COPY_FNC_LST:
+            try:
+                fnc(fd_in, fd_out, size)
+            except OSError:
+                # 途中まで書いた場合に備えて、出力を空にしてから次の方法を試す。
+                os.ftruncate(fd_out, 0)
+                os.lseek(fd_out, 0, os.SEEK_SET)
+                os.lseek(fd_in, 0, os.SEEK_SET)
+                continue
+            # 一部しかコピーできなかった場合(ファイルが縮んだ等)も成功とみなす。shutilと同じ。
+            break
+        else:
+            _copy_buffer(f_in, f_out)
+    shutil.copystat(src_abs, dst_abs)
+
+
+class Journal:
+    """コピーの予定と完了を記録するSQLiteファイル"""
+    SQL_CREATE = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS plan (
+        id INTEGER PRIMARY KEY,
+        src_abs TEXT, src_rel TEXT, dst_abs TEXT, dst_dir TEXT, type TEXT,
+        done INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_done ON plan (done);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_dst ON plan (dst_abs);
+    """
+
+    def __init__(self, path_in, dir_out, fp_db=None):
+        """ Constructor
+        :param path_in: 入力フォルダ
+        :param dir_out: 出力フォルダ
+        :param fp_db: ジャーナルファイルのパス。Noneの場合は、入出力フォルダの組み合わせ毎にキャッシュフォルダに保存する。
+        """
+        if fp_db is None:
+            key = os.path.normcase(os.path.abspath(path_in)) + '\n' + os.path.normcase(os.path.abspath(dir_out))
+            fp_db = os.path.join(DIR_JOURNAL, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.sqlite')
+        self.fp_db = fp_db
+        os.makedirs(os.path.dirname(self.fp_db), exist_ok=True)
+        self.con = sqlite3.connect(self.fp_db)
+        self.con.executescript(self.SQL_CREATE)
+        self._time_commit = time.perf_counter()
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
+
+    # 予定の記録が完了しているか？
+    def is_planned(self):
+        row = self.con.execute("SELECT value FROM meta WHERE key = 'status'").fetchone()
+        return row is not None and row[0] == 'planned'
+
+    @property
+    def count_pending(self):
+        return self.con.execute('SELECT COUNT(*) FROM plan WHERE done = 0').fetchone()[0]
+
+    # 記録を全て消す。
+    def reset(self):
+        self.con.execute('DELETE FROM plan')
+        self.con.execute('DELETE FROM meta')
+        self.con.commit()
+
+    def plan(self, rel_tpl_itr, batch_size=10000):
+        """RelTplを全て記録する。記録が完了するまでは、再開できない。"""
+        self.reset()
+        sql = 'INSERT INTO plan (src_abs, src_rel, dst_abs, dst_dir, type) VALUES (?, ?, ?, ?, ?)'
+        rows = []
+        for rel_tpl in rel_tpl_itr:
+            entry = rel_tpl.entry
+            path_type = entry.type if entry is not None else hpath.get_path_type(rel_tpl.src_abs)
+            rows.append((rel_tpl.src_abs, rel_tpl.src_rel, rel_tpl.dst_abs, rel_tpl.dst_dir, path_type))
+            if len(rows) >= batch_size:
+                self.con.executemany(sql, rows)
+                rows = []
+        self.con.executemany(sql, rows)
+        self.con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('status', 'planned')")
+        self.con.commit()
+
+    def yield_pending(self):
+        """未完了のRelTplを返すジェネレータ"""
+        # コピー中にmark_done()で更新するので、先にidだけ取得しておく。
+        id_lst = [i for i, in self.con.execute('SELECT id FROM plan WHERE done = 0 ORDER BY id')]
+        for i in id_lst:
+            src_abs, src_rel, dst_abs, dst_dir, path_type = self.con.execute(
+                'SELECT src_abs, src_rel, dst_abs, dst_dir, type FROM plan WHERE id = ?', (i,)).fetchone()
+            entry = hpath.Entry(src_abs, path_type)
+            yield hpath.RelTpl(src_abs=src_abs, src_rel=src_rel, dst_abs=dst_abs, dst_dir=dst_dir, entry=entry)
+
+    # 完了を記録する。コミットは一定間隔ごと。
+    # 出力パスは予定の中で一意なので、出力パスで検索する。
+    def mark_done(self, rel_tpl):
+        self.con.execute('UPDATE plan SET done = 1 WHERE dst_abs = ?', (rel_tpl.dst_abs,))
+        now = time.perf_counter()
+        if now - self._time_commit >= JOURNAL_COMMIT_INTERVAL:
+            self.con.commit()
+            self._time_commit = now
+
+    # 全て完了していたら、ジャーナルファイルを削除する。
+    def finish(self):
+        count = self.count_pending
+        self.close()
+        if count == 0:
+            os.remove(self.fp_db)
+        return count
+
+
+def skip_nested_dirs(rel_tpl_itr):
+    """ フォルダを再帰的にコピーする場合に、親フォルダが既に渡されたフォルダを除くジェネレータ
+    親フォルダのコピー(shutil.copytree)が配下も全てコピーするので、別のスレッドで同じファイルを書き込まないようにする。
+    走査は親フォルダを配下より先に返すので、渡されたフォルダを覚えておけば判定できる。
+    """
+    dir_set = set()
+    for rel_tpl in rel_tpl_itr:
+        path = os.path.normcase(rel_tpl.src_abs)
+        parent = os.path.dirname(path)
+        is_nested = False
+        while parent and parent != path:
+            if parent in dir_set:
+                is_nested = True
+                break
+            path, parent = parent, os.path.dirname(parent)
+        if is_nested:
+            continue
+        dir_set.add(os.path.normcase(rel_tpl.src_abs))
+        yield rel_tpl
+
+
+class Copier:
+    def __init__(self, workers=8, sync=False, use_hash=False, track=False, atomic=False, journal=None):
+        """ Constructor
+        :param workers: 同時にコピーするスレッド数
+        :param sync: 同期モード。出力先に同じファイルがあればコピーしない。
+        :param use_hash: 同期モードで、更新日時ではなく中身のハッシュで比較する。
+        :param track: コピー(もしくはスキップ)した出力ファイルのパスを覚えておく。find_extras()に必要。
+        :param atomic: 一時ファイルに書き込んでから名称変更する。
+        :param journal: Journal。完了したRelTplを記録する。
+        """
+        self.atomic = atomic
+        self.journal = journal
+        self.workers = workers
+        self.sync = sync
+        self.use_hash = use_hash
+        # 出力ファイルのパス
+        self.track = track
+        self.dst_set = set()
+        # 作成済みのフォルダ
+        self._dir_cache = set()
+        self._dir_lock = threading.Lock()
+
+    # 中間フォルダを作る。作成済みのフォルダは何もしない。
+    def make_dirs(self, dst_dir):
+        if dst_dir in self._dir_cache:
+            return
+        os.makedirs(dst_dir, exist_ok=True)
+        with self._dir_lock:
+            # 親フォルダも作成済みとして覚えておく。
+            path = dst_dir
+            while path and path not in self._dir_cache:
+                self._dir_cache.add(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    # 出力先に同じファイルが存在するか？
+    def is_same(self, src_abs, dst_abs):
+        try:
+            st_dst = os.stat(dst_abs)
+        except FileNotFoundError:
+            return False
+        st_src = os.stat(src_abs)
+        if st_src.st_size != st_dst.st_size:
+            return False
+        if self.use_hash:
+            return get_hash(src_abs) == get_hash(dst_abs)
+        return abs(st_src.st_mtime - st_dst.st_mtime) <= MTIME_TOLERANCE
+
+    # ファイルをコピーして、コピーしたバイト数を返す。
+    # 同期モードで同じファイルだった場合は、コピーせずにNoneを返す。
+    # sizeは入力ファイルのサイズ。Noneの場合はstatで調べる。
+    def copy_file(self, src_abs, dst_abs, size=None):
+        if self.track:
+            self.dst_set.add(os.path.normcase(dst_abs))
+        if self.sync and self.is_same(src_abs, dst_abs):
+            return None
+        if size is None:
+            size = os.path.getsize(src_abs)
+        if not self.atomic:
+            self._copy_by_size(src_abs, dst_abs, size)
+            return size
+
+        # 出力フォルダに一意な名称の一時ファイルを作って書き込んでから、名称変更する。
+        fd, fp_tmp = tempfile.mkstemp(dir=os.path.dirname(dst_abs), prefix=os.path.basename(dst_abs) + '.',
+                                      suffix=TMP_EXT)
+        os.close(fd)
+        try:
+            self._copy_by_size(src_abs, fp_tmp, size)
+            os.replace(fp_tmp, dst_abs)
+        except BaseException:
+            try:
+                os.remove(fp_tmp)
+            except OSError:
+                pass
+            raise
+        return size
+
+    # ファイルサイズでコピーの方法を選ぶ。
+    @staticmethod
+    def _copy_by_size(src_abs, fp_out, size):
+        if size >= LARGE_FILE_SIZE:
+            copy_large(src_abs, fp_out)
+        else:
+            shutil.copy2(src_abs, fp_out)
+
+    # フォルダを配下ごとコピーして、(コピーしたファイル数, スキップしたファイル数, バイト数)を返す。
+    def copy_dir(self, src_abs, dst_abs):
+        count, skipped, size = 0, 0, 0
+
+        def copy_function(src, dst):
+            nonlocal count, skipped, size
+            ret = self.copy_file(src, dst)
+            if ret is None:
+                skipped += 1
+            else:
+                count += 1
+                size += ret
+            return dst
+
+        # 同期モードとジャーナルの場合は、既存の出力フォルダ(前回のコピー途中のフォルダ)に上書きする。
+        dirs_exist_ok = self.sync or self.journal is not None
+        shutil.copytree(src_abs, dst_abs, copy_function=copy_function, dirs_exist_ok=dirs_exist_ok)
+        return count, skipped, size
+
+    # RelTplを一つコピーして、(コピーしたファイル数, スキップしたファイル数, バイト数)を返す。
+    # スレッドで実行される。
+    def _copy(self, rel_tpl):
+        self.make_dirs(rel_tpl.dst_dir)
+        entry = rel_tpl.entry
+        is_dir = entry.type == 'dir' if entry is not None else os.path.isdir(rel_tpl.src_abs)
+        if is_dir:
+            return self.copy_dir(rel_tpl.src_abs, rel_tpl.dst_abs)
+        else:
+            size = self.copy_file(rel_tpl.src_abs, rel_tpl.dst_abs, size=entry.size if entry is not None else None)
+            return (0, 1, 0) if size is None else (1, 0, size)
+
+    def run(self, rel_tpl_itr):
+        """ RelTplをコピーする。
+        :param rel_tpl_itr: hpath.RelTplのイテラブル。走査しながら渡されても良い。
+        :return: Summary
+        """
+        progress = Progress()
+        failures = []
+
+        # 完了したFutureを集計する。
+        # ジャーナルはメインスレッドだけで更新する。
+        def collect(done):
+            for future in done:
+                rel_tpl = running.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    count, skipped, size = future.result()
+                except OSError as e:
+                    failures.append((rel_tpl.src_abs, e))
+                    progress.add(0, 0, failed=1)
+                else:
+                    progress.add(count, size, skipped=skipped)
+                    if self.journal is not None:
+                        self.journal.mark_done(rel_tpl)
+
+        # 走査結果を溜めすぎないように、実行中のコピー数を制限する。
+        window = self.workers * 4
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                for rel_tpl in rel_tpl_itr:
+                    if len(running) >= window:
+                        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                        collect(done)
+                    running[pool.submit(self._copy, rel_tpl)] = rel_tpl
+                collect(concurrent.futures.wait(running).done)
+            # Ctrl+C：未着手のコピーを取り消し、実行中のコピーの完了を待って記録する。
+            except KeyboardInterrupt:
+                print('\nInterrupted. Waiting for running copies...')
+                for future in running:
+                    future.cancel()
+                collect(concurrent.futures.wait(running).done)
+
+        progress.print(end='\n')
+        return Summary(count=progress.count, size=progress.size, seconds=progress.seconds, failures=failures,
+                       skipped=progress.skipped)
+
+    def find_extras(self, dir_lst, recursive=True):
+        """ 出力フォルダにだけ存在する余分なファイルを返すジェネレータ
+        track=Trueでrun()を実行した後に呼ぶ。
+        :param dir_lst: 探す出力フォルダのリスト
+        :param recursive: 再帰検索のフラグ
+        """
+        for dir_path in dir_lst:
+            if not os.path.isdir(dir_path):
+                continue
+            for entry in hpath.Dir(dir_path).scan(recursive=recursive):
+                if os.path.normcase(entry.path) not in self.dst_set:
+                    yield entry.path
+
+
+def print_summary(summary):
+    mb = summary.size / 1024 ** 2
+    sec = max(summary.seconds, 1e-9)
+    print(f'=== Copy Result ===')
+    print(f'\tcopied : {summary.count} files, {mb:.1f} MB in {summary.seconds:.1f} s '
+          f'({summary.count / sec:.1f} files/s, {mb / sec:.1f} MB/s)')
+    print(f'\tskipped: {summary.skipped} (unchanged)')
+    print(f'\tfailed : {len(summary.failures)}')
+    for i, (src_abs, e) in enumerate(summary.failures):
+        print(f'\t{i}: {src_abs} {e}')
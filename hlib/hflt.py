@@ -0,0 +1,143 @@
+"""
+Filter
+ファイル・フォルダを判定するフィルタ
+
+■　判定の順番
+    判定関数は、コストが安い順に並べ替えてから評価する。
+    all()/any()にはジェネレータを渡すので、結果が確定した時点で残りの判定関数は評価しない。
+    例えば、拡張子で不合格になったファイルは、更新日時(stat)を確認しない。
+
+■　フォルダの枝刈り
+    add_dir()で登録した判定関数はフォルダに対して評価され、不合格のフォルダは配下ごと走査しない。
+    all/anyの設定とは関係なく、全てのフォルダの判定関数に合格したフォルダだけを走査する。
+"""
+import re
+
+# 判定関数のコスト
+# 名称だけで判定できるもの
+COST_NAME = 1
+# 絶対パス全体を見るもの
+COST_PATH = 2
+# stat情報(サイズ・更新日時)が必要なもの
+COST_STAT = 10
+
+# サイズの単位
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+class Filter:
+    def __init__(self, logic=all):
+        """ Constructor
+        :param logic: 関数「all」もしくは関数「any」
+        """
+        self.logic = logic
+        # (コスト, 登録順, 判定関数)のリスト
+        self.fnc_lst = []
+        # フォルダの判定関数のリスト
+        self.dir_fnc_lst = []
+        self._fnc = None
+
+    # 判定関数の設計ルール
+    # 　「argument」は「hpath.Entry」もしくは「hpath.Path」
+    # 　「return」は判定結果の「Boolean」
+    def add(self, fnc, cost=COST_NAME):
+        self.fnc_lst.append((cost, len(self.fnc_lst), fnc))
+        self._fnc = None
+
+    # フォルダの判定関数を登録する。Falseを返したフォルダは配下ごと走査しない。
+    def add_dir(self, fnc):
+        self.dir_fnc_lst.append(fnc)
+
+    # ---------------------------------------------------------------------------------
+    # よく使う判定関数
+
+    def add_base_name_regex(self, pattern):
+        self.add(lambda entry: pattern.match(entry.base_name) is not None, COST_NAME)
+
+    def add_path_regex(self, pattern):
+        self.add(lambda entry: pattern.match(entry.path) is not None, COST_PATH)
+
+    # 拡張子は「.XML」のように大文字で比較する。
+    def add_ext(self, ext_lst):
+        ext_set = {ext.upper() if ext.startswith('.') else '.' + ext.upper() for ext in ext_lst}
+        self.add(lambda entry: entry.ext_upper in ext_set, COST_NAME)
+
+    def add_time_stamp_min(self, ts_min):
+        self.add(lambda entry: entry.time_stamp > ts_min, COST_STAT)
+
+    def add_time_stamp_max(self, ts_max):
+        self.add(lambda entry: entry.time_stamp < ts_max, COST_STAT)
+
+    def add_size_min(self, size_min):
+        self.add(lambda entry: entry.size >= size_min, COST_STAT)
+
+    def add_size_max(self, size_max):
+        self.add(lambda entry: entry.size <= size_max, COST_STAT)
+
+    # フォルダの名称が合致したら、配下ごと走査しない。
+    def add_dir_skip_regex(self, pattern):
+        self.add_dir(lambda entry: pattern.match(entry.base_name) is None)
+
+    # ---------------------------------------------------------------------------------
+
+    # 判定関数をコストの安い順に並べて、一つの関数にまとめる。
+    def compile(self):
+        fnc_lst = [fnc for cost, i, fnc in sorted(self.fnc_lst, key=lambda x: (x[0], x[1]))]
+        logic = self.logic
+
+        # 判定関数が無ければ、判定する必要が無いので「True」を返す。
+        if len(fnc_lst) == 0:
+            self._fnc = lambda entry: True
+        # 一つだけならそのまま使う。
+        elif len(fnc_lst) == 1:
+            self._fnc = fnc_lst[0]
+        else:
+            self._fnc = lambda entry: logic(fnc(entry) for fnc in fnc_lst)
+        return self._fnc
+
+    def __call__(self, entry):
+        if self._fnc is None:
+            self.compile()
+        return self._fnc(entry)
+
+    # フォルダを配下ごと走査しない場合は「True」。ファイルは常に「False」(ファイルの判定は__call__()でする)
+    # hpath.Dir.scan()のpruneに渡す。
+    def prune(self, entry):
+        if entry.type != 'dir':
+            return False
+        return not all(fnc(entry) for fnc in self.dir_fnc_lst)
+
+    @property
+    def has_dir_fnc(self):
+        return len(self.dir_fnc_lst) > 0
+
+
+class Prompt:
+    # 「100」「10k」「1.5M」「2G」のように、単位付きのサイズをバイト数で返す。
+    @staticmethod
+    def get_size(msg='Size (e.g. 100, 10k, 1.5M, 2G): '):
+        while True:
+            s = input(msg).strip().upper().rstrip('B')
+            m = re.fullmatch(r'([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?)', s)
+            if m:
+                return int(float(m.group(1)) * SIZE_UNITS[m.group(2)])
+            else:
+                print('Input Invalid')
+
+    # 「xml txt」「.xml .txt」のように、空白区切りで拡張子のリストを返す。
+    @staticmethod
+    def get_ext_lst(msg='Extensions separated by space (e.g. xml txt): '):
+        while True:
+            ext_lst = input(msg).split()
+            if len(ext_lst) > 0:
+                return ext_lst
+            else:
+                print('Input Invalid')
+
+
+def _test():
+    print(Prompt.get_size())
+
+
+if __name__ == '__main__':
+    _test()
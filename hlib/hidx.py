@@ -0,0 +1,235 @@
+"""
+フォルダのインデックス
+フォルダ構造(パス、タイプ、サイズ、更新日時)をSQLiteファイルに保存して、同じフォルダの再走査を速くする。
+
+■　再走査の仕組み
+    フォルダの更新日時は、直下のファイル・フォルダが追加・削除・名称変更された時に更新される。
+    前回の走査時からフォルダの更新日時が変わっていない場合は、そのフォルダを読み込まずにインデックスの内容を使う。
+    サブフォルダの更新日時は親フォルダに伝わらないので、フォルダ毎にstatを一回だけ呼ぶ。
+
+■　枝刈り
+    rescan()にpruneを渡すと、pruneがTrueを返したフォルダ(node_modules等)は読み込まない。
+    枝刈りしたフォルダの行自体は残すが、配下は前回の内容のままになるので、scan()にも同じpruneを渡す。
+    次にpruneを変えて走査した場合も、フォルダ毎に更新日時を確認するので、古い内容は読み込み直される。
+
+■　注意
+    ファイルの中身が上書きされただけでは、フォルダの更新日時は変わらない。
+    ファイルのサイズと更新日時を厳密に更新したい場合は、rescan(full=True)で全て読み直す。
+"""
+import os
+import hashlib
+import sqlite3
+
+try:
+    from hlib import hpath
+except ImportError:
+    try:
+        import hpath
+    except ImportError:
+        print('import hpath failed')
+
+
+# キャッシュファイルを保存するフォルダ
+# Windowsの場合は「%LOCALAPPDATA%\SendTo」
+DIR_APP_CACHE = os.path.join(os.getenv('localappdata') or os.path.join(os.path.expanduser('~'), '.cache'), 'SendTo')
+
+# インデックスファイルの既定の保存先
+DIR_CACHE = os.path.join(DIR_APP_CACHE, 'index')
+
+# コミットする間隔(フォルダ数)
+COMMIT_INTERVAL = 1000
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    listed_mtime REAL
+);
+CREATE INDEX IF NOT EXISTS idx_parent ON entries (parent);
+"""
+
+
+# ルートフォルダのパスから、キャッシュフォルダ内のインデックスファイルのパスを作る。
+def get_default_db_path(root):
+    key = os.path.normcase(os.path.abspath(root)).encode('utf-8')
+    fn = hashlib.sha1(key).hexdigest() + '.sqlite'
+    return os.path.join(DIR_CACHE, fn)
+
+
+class Index:
+    def __init__(self, root, fp_db=None):
+        """ Constructor
+        :param root: インデックスを作るフォルダ
+        :param fp_db: インデックスファイルのパス。Noneの場合はキャッシュフォルダに保存する。
+        """
+        if not os.path.isdir(root):
+            raise ValueError(f'{root} is not a folder.')
+        self.root = os.path.abspath(root)
+        self.fp_db = fp_db if fp_db else get_default_db_path(self.root)
+
+        # インデックスファイルを開く
+        os.makedirs(os.path.dirname(self.fp_db), exist_ok=True)
+        self.con = sqlite3.connect(self.fp_db)
+        self.con.executescript(SQL_CREATE)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # フォルダ配下(フォルダ自身は含まない)の行を範囲で指定する為のキー
+    # 主キーのインデックスを使えるように、LIKEではなく大小比較にする。
+    @staticmethod
+    def _range(path):
+        path = path.rstrip(os.sep)
+        return path + os.sep, path + chr(ord(os.sep) + 1)
+
+    # フォルダとその配下の行を削除する。
+    def _delete_tree(self, path):
+        self.con.execute('DELETE FROM entries WHERE path = ?', (path,))
+        self.con.execute('DELETE FROM entries WHERE path > ? AND path < ?', self._range(path))
+
+    # フォルダを読み込んで、直下の行を更新する。
+    # 戻り値はサブフォルダのパスのリスト。pruneがTrueを返したフォルダは含まない。
+    def _list_dir(self, dir_path, mtime, prune=None):
+        # 読み込む前の行
+        old = {path: path_type for path, path_type in
+               self.con.execute('SELECT path, type FROM entries WHERE parent = ?', (dir_path,))}
+
+        rows = []
+        sub_dirs = []
+        for entry in hpath.yield_entries(dir_path):
+            if entry.type == 'err':
+                continue
+            try:
+                size, ts = entry.size, entry.time_stamp
+            except OSError:
+                continue
+            rows.append((entry.path, dir_path, entry.type, size, ts))
+            # シンボリックリンクのフォルダと、枝刈りするフォルダには潜らない。
+            if entry.type == 'dir' and not entry.is_symlink and not (prune is not None and prune(entry)):
+                sub_dirs.append(entry.path)
+            # タイプが変わった場合は、古い行(と配下)を削除する。
+            if old.pop(entry.path, entry.type) != entry.type:
+                self._delete_tree(entry.path)
+
+        # 無くなったファイル・フォルダを削除する。
+        for path in old:
+            self._delete_tree(path)
+
+        # 直下の行を更新する。フォルダの場合、listed_mtimeは既存の値を保持する。
+        self.con.executemany("""
+            INSERT INTO entries (path, parent, type, size, mtime) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET type = excluded.type, size = excluded.size, mtime = excluded.mtime
+            """, rows)
+
+        # このフォルダを読み込んだ時の更新日時を記録する。
+        self.con.execute('UPDATE entries SET listed_mtime = ? WHERE path = ?', (mtime, dir_path))
+        return sub_dirs
+
+    def rescan(self, full=False, prune=None):
+        """ インデックスを更新する。
+        :param full: Trueの場合は、更新日時に関わらず全てのフォルダを読み込む。
+        :param prune: Entryを受けて、読み込まないフォルダの場合にTrueを返す関数(hpath.Dir.scan()を参照)
+        :return: 読み込んだフォルダの数と、インデックスの内容を使ったフォルダの数
+        """
+        count_listed = 0
+        count_skipped = 0
+
+        # ルートフォルダの行
+        st = os.stat(self.root)
+        self.con.execute("""
+            INSERT INTO entries (path, parent, type, size, mtime) VALUES (?, '', 'dir', ?, ?)
+            ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime
+            """, (self.root, st.st_size, st.st_mtime))
+
+        stack = [self.root]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                mtime = os.stat(dir_path).st_mtime
+            except OSError:
+                # 走査中に削除されたフォルダ
+                self._delete_tree(dir_path)
+                continue
+
+            row = self.con.execute('SELECT listed_mtime FROM entries WHERE path = ?', (dir_path,)).fetchone()
+            # 前回から変わっていない：インデックスからサブフォルダを取得する。
+            if not full and row is not None and row[0] == mtime:
+                sub_dirs = [hpath.Entry(path, 'dir', time_stamp=ts, size=size) for path, size, ts in self.con.execute(
+                    "SELECT path, size, mtime FROM entries WHERE parent = ? AND type = 'dir'", (dir_path,))]
+                if prune is not None:
+                    sub_dirs = [entry for entry in sub_dirs if not prune(entry)]
+                # シンボリックリンクか？はインデックスに無いので、ここで確認する。
+                sub_dirs = [entry.path for entry in sub_dirs if not os.path.islink(entry.path)]
+                count_skipped += 1
+            # 変わっている：フォルダを読み込む。
+            else:
+                sub_dirs = self._list_dir(dir_path, mtime, prune=prune)
+                count_listed += 1
+
+            stack.extend(sorted(sub_dirs, reverse=True))
+
+            # 定期的にコミットする。
+            if (count_listed + count_skipped) % COMMIT_INTERVAL == 0:
+                self.con.commit()
+
+        self.con.commit()
+        print(f'index: listed {count_listed} folders, reused {count_skipped} folders. ({self.fp_db})')
+        return count_listed, count_skipped
+
+    def scan(self, target='file', recursive=True, prune=None):
+        """hpath.Dir.scan()と同じように、インデックスからEntryを返すジェネレータ"""
+        # 枝刈りする場合は、親フォルダを辿って走査する。
+        if prune is not None:
+            yield from self._scan_prune(target=target, recursive=recursive, prune=prune)
+            return
+        if recursive:
+            cur = self.con.execute("""
+                SELECT path, type, size, mtime FROM entries WHERE path > ? AND path < ? AND type = ?
+                ORDER BY path
+                """, (*self._range(self.root), target))
+        else:
+            cur = self.con.execute("""
+                SELECT path, type, size, mtime FROM entries WHERE parent = ? AND type = ?
+                ORDER BY path
+                """, (self.root, target))
+        for path, path_type, size, mtime in cur:
+            yield hpath.Entry(path, path_type, time_stamp=mtime, size=size)
+
+    def _scan_prune(self, target, recursive, prune):
+        stack = [self.root]
+        while stack:
+            dir_path = stack.pop()
+            sub_dirs = []
+            for path, path_type, size, mtime in self.con.execute("""
+                    SELECT path, type, size, mtime FROM entries WHERE parent = ? ORDER BY path
+                    """, (dir_path,)).fetchall():
+                entry = hpath.Entry(path, path_type, time_stamp=mtime, size=size)
+                if prune(entry):
+                    continue
+                if path_type == 'dir':
+                    sub_dirs.append(path)
+                if path_type == target:
+                    yield entry
+            if recursive:
+                stack.extend(reversed(sub_dirs))
+
+
+def _test():
+    import sys
+    with Index(sys.argv[1]) as idx:
+        idx.rescan()
+        for i, entry in enumerate(idx.scan()):
+            print(i, entry.path, entry.size, entry.time_stamp)
+
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,150 @@
+"""
+Ignore
+除外パターン(ワイルドカード・.gitignore形式)で、走査しないファイル・フォルダを判定する。
+
+■　パターンの書式 (.gitignoreのサブセット)
+    空行と「#」で始まる行は無視する。
+    「!」で始まるパターンは、除外を取り消す。後に書いたパターンが優先される。
+    「/」で終わるパターンは、フォルダだけに合致する。
+    途中か先頭に「/」を含むパターンは、ルートフォルダからの相対パスに合致する。含まない場合は、任意の階層の名称に合致する。
+    「*」「?」「[...]」は「/」を跨がない。「**」は「/」を跨ぐ。
+
+■　一つの正規表現にまとめる
+    全てのパターンを名前付きグループの選択「|」で一つの正規表現にまとめてコンパイルする。
+    後に書いたパターンを前に並べておくと、最初に合致したグループが、.gitignoreで優先されるパターンになる。
+    なので、Entry毎の判定は、正規表現のマッチ一回で済む。
+
+■　注意
+    ルートフォルダの除外ファイルだけを読み込む。サブフォルダの除外ファイルは読み込まない。
+    除外されたフォルダは走査しないので、その配下のファイルを「!」で取り消すことはできない(.gitignoreと同じ)。
+"""
+import os
+import re
+
+# ルートフォルダで読み込む除外ファイル
+IGNORE_FILES = ['.gitignore', '.sendtoignore']
+
+
+# ワイルドカードを正規表現に変換する。
+def _glob_to_rgx(glob):
+    rgx = ''
+    i = 0
+    n = len(glob)
+    while i < n:
+        c = glob[i]
+        if glob.startswith('**/', i):
+            rgx += '(?:.*/)?'
+            i += 3
+        elif glob.startswith('**', i):
+            rgx += '.*'
+            i += 2
+        elif c == '*':
+            rgx += '[^/]*'
+            i += 1
+        elif c == '?':
+            rgx += '[^/]'
+            i += 1
+        elif c == '[':
+            j = glob.find(']', i + 2)
+            if j == -1:
+                rgx += re.escape(c)
+                i += 1
+            else:
+                body = glob[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                rgx += '[' + body.replace('\\', '\\\\') + ']'
+                i = j + 1
+        else:
+            rgx += re.escape(c)
+            i += 1
+    return rgx
+
+
+class Matcher:
+    def __init__(self, root, pattern_lst):
+        """ Constructor
+        :param root: 相対パスの基準になるフォルダ
+        :param pattern_lst: .gitignore形式のパターンのリスト
+        """
+        self.prefix = root.rstrip('\\/') + os.sep
+        self.pattern_lst = []
+        # (正規表現, 取り消しか？)のリスト
+        rules = []
+        for line in pattern_lst:
+            line = line.rstrip('\r\n').rstrip(' ')
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            self.pattern_lst.append(line)
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            # 「/」を含むパターンはルートからの相対パス、含まないパターンは任意の階層の名称
+            if '/' in line:
+                rgx = _glob_to_rgx(line.lstrip('/'))
+            else:
+                rgx = '(?:.*/)?' + _glob_to_rgx(line)
+            rules.append((rgx, negate, dir_only))
+
+        # 取り消しのフラグは、グループ名称で引く。
+        self.negate = {}
+        flags = re.IGNORECASE if os.name == 'nt' else 0
+        self.rgx_file = self._compile([r for r in rules if not r[2]], flags)
+        self.rgx_dir = self._compile(rules, flags)
+
+    # 後のパターンを前にして、一つの正規表現にまとめる。
+    def _compile(self, rules, flags):
+        if len(rules) == 0:
+            return None
+        groups = []
+        for i, (rgx, negate, dir_only) in reversed(list(enumerate(rules))):
+            name = f'p{len(self.negate)}'
+            self.negate[name] = negate
+            groups.append(f'(?P<{name}>{rgx})')
+        return re.compile('(?:' + '|'.join(groups) + r')\Z', flags)
+
+    @classmethod
+    def from_files(cls, root, glob_lst=(), fn_lst=IGNORE_FILES):
+        """ルートフォルダの除外ファイルと、追加のパターンからMatcherを作る。"""
+        pattern_lst = []
+        for fn in fn_lst:
+            fp = os.path.join(root, fn)
+            if os.path.isfile(fp):
+                with open(fp, encoding='utf-8', errors='ignore') as f:
+                    pattern_lst.extend(f.read().splitlines())
+        # 追加のパターンは、除外ファイルより優先する。
+        pattern_lst.extend(glob_lst)
+        return cls(root, pattern_lst)
+
+    def is_excluded(self, path, is_dir=False):
+        rgx = self.rgx_dir if is_dir else self.rgx_file
+        if rgx is None:
+            return False
+        # ルートからの相対パスを「/」区切りにする。
+        if path.startswith(self.prefix):
+            rel = path[len(self.prefix):]
+        else:
+            rel = os.path.basename(path)
+        if os.sep != '/':
+            rel = rel.replace(os.sep, '/')
+        m = rgx.match(rel)
+        return m is not None and not self.negate[m.lastgroup]
+
+    # hpath.Dir.scan()のpruneに渡す。
+    def prune(self, entry):
+        return self.is_excluded(entry.path, is_dir=entry.type == 'dir')
+
+
+def _test():
+    m = Matcher('/root', ['node_modules/', '*.pyc', '!keep.pyc', '/build', 'docs/**/*.tmp'])
+    for path, is_dir in [('/root/a/node_modules', True), ('/root/a/node_modules', False),
+                         ('/root/x.pyc', False), ('/root/a/keep.pyc', False),
+                         ('/root/build', True), ('/root/a/build', True),
+                         ('/root/docs/a/b/c.tmp', False), ('/root/docs/c.tmp', False)]:
+        print(path, is_dir, m.is_excluded(path, is_dir))
+
+
+if __name__ == '__main__':
+    _test()
@@ -3,6 +3,7 @@
 """
 import os
 import collections
+import concurrent.futures
 
 
 # パスはベースのAbstractクラスっぽい雰囲気をだしているけど、、
@@ -55,27 +56,167 @@ class Dir(Path):
 
     # 絶対パスを返すジェネレータ
     def mapper(self, target='file', recursive=True):
-        # 再帰
-        if recursive:
-            for root, dirs, files in os.walk(self.path):
-                # ファイル
-                if target == 'file':
-                    for file in files:
-                        yield os.path.join(root, file)
-                # フォルダ
-                elif target == 'dir':
-                    for _dir in dirs:
-                        yield os.path.join(root, _dir)
-        # 直下
+        for entry in self.scan(target=target, recursive=recursive):
+            yield entry.path
+
+    # Entryを返すジェネレータ
+    # os.scandir()を使うので、フォルダ毎に一回の読み込みで済み、ファイル毎のisfile()やgetmtime()が不要になる。
+    # 順番はos.walk()と同じで、フォルダの直下を返してから、サブフォルダに潜る。
+    # pruneは、Entryを受けてBooleanを返す関数。Trueを返したEntryは返さない。フォルダの場合は配下も走査しない。
+    def scan(self, target='file', recursive=True, prune=None):
+        # 未処理のフォルダのスタック
+        stack = [self.path]
+        while stack:
+            dir_path = stack.pop()
+            sub_dirs = []
+            for entry in yield_entries(dir_path):
+                # 枝刈り
+                if prune is not None and prune(entry):
+                    continue
+                # os.walk()と同様に、シンボリックリンクのフォルダには潜らない。
+                if entry.type == 'dir' and recursive and not entry.is_symlink:
+                    sub_dirs.append(entry.path)
+                if entry.type == target:
+                    yield entry
+            # スタックなので逆順に積むと、os.scandir()の順番に処理される。
+            stack.extend(reversed(sub_dirs))
+
+    # 複数のスレッドでフォルダを同時に読み込み、Entryを返すジェネレータ
+    # SMBやNFS等のフォルダの読み込みの待ち時間が長いファイルシステムで、待ち時間を重ねて走査を速くする。
+    # workers: 同時に読み込むフォルダ数の上限
+    # ordered: Trueの場合はscan()と同じ順番で返す。Falseの場合は読み込みが終わった順番に返す。
+    def scan_parallel(self, target='file', recursive=True, workers=8, ordered=False, prune=None):
+        # 直下だけなら並列化する意味が無い。
+        if not recursive or workers < 2:
+            yield from self.scan(target=target, recursive=recursive, prune=prune)
+            return
+
+        # 読み込み結果をメモリに溜めすぎないように、先読みするフォルダ数を制限する。
+        window = workers * 2
+
+        # サブフォルダのリストを返しつつ、ターゲットのEntryを選ぶ。
+        def split(entries):
+            if prune is not None:
+                entries = [e for e in entries if not prune(e)]
+            sub_dirs = [e.path for e in entries if e.type == 'dir' and not e.is_symlink]
+            return sub_dirs, [e for e in entries if e.type == target]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            # 順番を保つ：scan()と同じスタックで処理し、スタックの上にあるフォルダを先読みする。
+            # 先読みはwindow個まで。サブフォルダが積まれて先読みの範囲から外れたフォルダは、
+            # 読み込み前ならキャンセルして、範囲に戻った時に読み込み直す。
+            if ordered:
+                stack = [self.path]
+                futures = {}
+                while stack:
+                    top = stack[-window:]
+                    top_set = set(top)
+                    for dir_path in [p for p in futures if p not in top_set]:
+                        if futures[dir_path].cancel():
+                            del futures[dir_path]
+                    for dir_path in reversed(top):
+                        if len(futures) >= window:
+                            break
+                        if dir_path not in futures:
+                            futures[dir_path] = pool.submit(_list_entries, dir_path)
+                    dir_path = stack.pop()
+                    # 範囲外の読み込み中のフォルダで先読みが埋まっている場合は、このスレッドで読み込む。
+                    future = futures.pop(dir_path, None)
+                    sub_dirs, entries = split(future.result() if future else _list_entries(dir_path))
+                    yield from entries
+                    stack.extend(reversed(sub_dirs))
+            # 順番を保たない：読み込みが終わったフォルダから返す。
+            else:
+                pending = [self.path]
+                running = set()
+                while pending or running:
+                    while pending and len(running) < window:
+                        running.add(pool.submit(_list_entries, pending.pop()))
+                    done, running = concurrent.futures.wait(running,
+                                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        sub_dirs, entries = split(future.result())
+                        yield from entries
+                        pending.extend(sub_dirs)
+
+
+# os.scandir()のDirEntryから作る軽量なパス
+# DirEntryがキャッシュしているタイプとstat情報を使うので、Pathのようにファイル毎にstatを呼ばない。
+# Windowsではフォルダの読み込み時にstat情報も取得されるので、time_stampとsizeも追加の通信が不要。
+class Entry(Path):
+    def __init__(self, path, path_type, time_stamp=None, size=None, is_symlink=False, dir_entry=None):
+        super().__init__(path)
+        self.type = path_type
+        self.is_symlink = is_symlink
+        self._time_stamp = time_stamp
+        self._size = size
+        self._dir_entry = dir_entry
+
+    @classmethod
+    def from_dir_entry(cls, dir_entry):
+        # ファイルでもフォルダでもないもの(壊れたリンク等)は「err」とする。
+        try:
+            if dir_entry.is_dir():
+                path_type = 'dir'
+            elif dir_entry.is_file():
+                path_type = 'file'
+            else:
+                path_type = 'err'
+            is_symlink = dir_entry.is_symlink()
+        except OSError:
+            path_type = 'err'
+            is_symlink = False
+        return cls(dir_entry.path, path_type, is_symlink=is_symlink, dir_entry=dir_entry)
+
+    # stat情報は必要になった時に一度だけ取得する。
+    def _load_stat(self):
+        if self._dir_entry is not None:
+            st = self._dir_entry.stat()
         else:
-            for basename in os.listdir(self.path):
-                abs_path = os.path.join(self.path, basename)
-                # ファイル
-                if target == 'file' and os.path.isfile(abs_path):
-                    yield abs_path
-                # フォルダ
-                elif target == 'dir' and os.path.isdir(abs_path):
-                    yield abs_path
+            st = os.stat(self.path)
+        self._time_stamp = st.st_mtime
+        self._size = st.st_size
+
+    @property
+    def time_stamp(self):
+        if self._time_stamp is None:
+            self._load_stat()
+        return self._time_stamp
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._load_stat()
+        return self._size
+
+    @property
+    def base_name(self):
+        if self._dir_entry is not None:
+            return self._dir_entry.name
+        return os.path.basename(self.path)
+
+    @property
+    def ext_upper(self):
+        return os.path.splitext(self.base_name)[1].upper()
+
+
+# フォルダの直下のEntryを返すジェネレータ
+# os.walk()と同様に、読み込めないフォルダは無視する。
+def yield_entries(dir_path):
+    try:
+        it = os.scandir(dir_path)
+    except OSError as e:
+        print(f'ERROR: failed to read {dir_path}. {e}')
+        return
+    with it:
+        for dir_entry in it:
+            yield Entry.from_dir_entry(dir_entry)
+
+
+# フォルダの直下のEntryのリスト
+# スレッドで実行するので、ジェネレータではなくリストで返す。
+def _list_entries(dir_path):
+    return list(yield_entries(dir_path))
 
 
 # 相対パス
@@ -83,23 +224,35 @@ class Rel(Dir):
     # 中間フォルダを考慮する場合、再帰は自明の理なのでrecursive=Trueで固定すべきだけど、
     # Relクラスの使い勝手を考えると、recursiveも含めておくと使い勝手が良いので、recursiveもメンバーに含めておく。
     # path_inは、フォルダであるべき。
-    def __init__(self, path, dir_out, target='file', recursive=True):
+    # lazy=Trueの場合はリストを構築せず、yield_rel_tpl()が走査しながらRelTplを一つずつ計算する。
+    # 巨大なフォルダでも、メモリ使用量は一定で、最初のファイルをすぐに処理できる。
+    # scan_fncは、Dir.scan()と同じ引数(target, recursive)でEntryを返す関数。Noneの場合はDir.scan()を使う。
+    # 例えば、hidx.Index.scanを渡すとインデックスからファイルリストを読む。
+    def __init__(self, path, dir_out, target='file', recursive=True, lazy=False, scan_fnc=None):
         super().__init__(path)
+        self.scan_fnc = scan_fnc if scan_fnc else self.scan
         self.dir_out = dir_out
         self.target = target
         self.recursive = recursive
+        self.lazy = lazy
         self.src_rel_lst = []
         self.src_abs_lst = []
         self.dst_dir_lst = []
         self.dst_abs_lst = []
+        self.entry_lst = []
 
-        # 渡された引数が適切な場合はリストデータを構築する。
-        if self.is_args_valid():
-            self.populate_list()
-        # 不適切な引数の場合はエラー
-        else:
+        # 渡された引数が不適切な場合はエラー
+        if not self.is_args_valid():
             raise ValueError('Invalid Input!')
 
+        # 出力フォルダが入力フォルダの中にある場合、走査中にコピーしたファイルを拾ってしまうので、遅延モードは使わない。
+        if self.lazy and self.is_dir_out_inside():
+            self.lazy = False
+
+        # 遅延モードでない場合はリストデータを構築する。
+        if not self.lazy:
+            self.populate_list()
+
     def is_args_valid(self):
         if os.path.isdir(self.path):
             if os.path.isdir(self.dir_out):
@@ -107,31 +260,63 @@ class Rel(Dir):
                     return True
         return False
 
-    def populate_list(self):
-        for src_abs in self.mapper(target=self.target, recursive=self.recursive):
-            # 絶対　入力パス
-            self.src_abs_lst.append(src_abs)
+    def is_dir_out_inside(self):
+        src = os.path.normcase(os.path.abspath(self.path))
+        dst = os.path.normcase(os.path.abspath(self.dir_out))
+        # Windowsでドライブが異なる場合はValueError
+        try:
+            return os.path.commonpath([src, dst]) == src
+        except ValueError:
+            return False
+
+    # 入力フォルダからの相対パス
+    # str.replace()だと、パスの途中に同じ文字列があった場合も置換されてしまうので、先頭だけを切り取る。
+    def get_rel(self, src_abs):
+        prefix = self.path.rstrip('\\/') + os.sep
+        if src_abs.startswith(prefix):
+            return src_abs[len(prefix):]
+        return os.path.relpath(src_abs, self.path)
+
+    # EntryからRelTplを構築する。
+    def create_rel_tpl(self, entry):
+        # 絶対　入力パス
+        src_abs = entry.path
 
-            # 相対　入力パス
-            src_rel = src_abs.replace(self.path, '').strip(os.sep)
-            self.src_rel_lst.append(src_rel)
+        # 相対　入力パス
+        src_rel = self.get_rel(src_abs)
 
-            # 絶対　出力パス
-            dst_abs = os.path.join(self.dir_out, src_rel)
-            self.dst_abs_lst.append(dst_abs)
+        # 絶対　出力パス
+        dst_abs = os.path.join(self.dir_out, src_rel)
 
-            # 絶対　出力パスの親フォルダ
-            # 出力先に相対フォルダを作成する為に必要
-            dst_dir = os.path.dirname(dst_abs)
-            self.dst_dir_lst.append(dst_dir)
+        # 絶対　出力パスの親フォルダ
+        # 出力先に相対フォルダを作成する為に必要
+        dst_dir = os.path.dirname(dst_abs)
+
+        return RelTpl(src_abs=src_abs, src_rel=src_rel, dst_abs=dst_abs, dst_dir=dst_dir, entry=entry)
+
+    def populate_list(self):
+        for entry in self.scan_fnc(target=self.target, recursive=self.recursive):
+            rel_tpl = self.create_rel_tpl(entry)
+            self.src_abs_lst.append(rel_tpl.src_abs)
+            self.src_rel_lst.append(rel_tpl.src_rel)
+            self.dst_abs_lst.append(rel_tpl.dst_abs)
+            self.dst_dir_lst.append(rel_tpl.dst_dir)
+            self.entry_lst.append(entry)
 
     def yield_rel_tpl(self):
-        for src_abs, src_rel, dst_abs, dst_dir in zip(
-                self.src_abs_lst, self.src_rel_lst, self.dst_abs_lst, self.dst_dir_lst):
-            yield RelTpl(src_abs=src_abs, src_rel=src_rel, dst_abs=dst_abs, dst_dir=dst_dir)
+        # 遅延モード：走査しながら計算する。
+        if self.lazy:
+            for entry in self.scan_fnc(target=self.target, recursive=self.recursive):
+                yield self.create_rel_tpl(entry)
+        # 構築済みのリストから返す。
+        else:
+            for src_abs, src_rel, dst_abs, dst_dir, entry in zip(
+                    self.src_abs_lst, self.src_rel_lst, self.dst_abs_lst, self.dst_dir_lst, self.entry_lst):
+                yield RelTpl(src_abs=src_abs, src_rel=src_rel, dst_abs=dst_abs, dst_dir=dst_dir, entry=entry)
 
 
-RelTpl = collections.namedtuple('RelTpl', ['src_abs', 'src_rel', 'dst_abs', 'dst_dir'])
+# entryは、入力パスのEntryオブジェクト。フィルタ関数に渡す。
+RelTpl = collections.namedtuple('RelTpl', ['src_abs', 'src_rel', 'dst_abs', 'dst_dir', 'entry'], defaults=[None])
 
 
 class Prompt:
@@ -0,0 +1,149 @@
+"""
+Report
+ファイル毎の結果を、一件ずつファイルに書き込むライター
+
+■　形式
+    yaml: 「- file: ...」のリストの要素を一件ずつ追記する。全件を書き終わると、一つのリストのYAMLになる。
+          libyamlがインストールされている場合は、C言語のダンパー(CSafeDumper)を使う。
+    jsonl: 一件を一行のJSONにする(JSON Lines)。
+    csv: 縦長の表にする。列は「file」、キーの列(例：「tag」)、「count」で、ファイルの結果に関わらず同じ。
+         結果が辞書のリスト(例：検証のエラー)の場合は、一つの辞書を一行にする(RowCsvWriter)。
+
+■　途中で止まった場合
+    一件毎にflush()するので、それまでの結果はファイルに残る。
+"""
+import csv
+import json
+import yaml
+
+# libyamlが無い場合は、Pythonのダンパーを使う。
+try:
+    YamlDumper = yaml.CSafeDumper
+except AttributeError:
+    YamlDumper = yaml.SafeDumper
+
+
+class _Writer:
+    def __init__(self, fp_out):
+        self.fp_out = fp_out
+        self.f = open(fp_out, 'w', encoding='utf-8', newline='')
+        self.count = 0
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # _write()は、サブクラスで定義する。
+    def write(self, file, data):
+        self._write(file, data)
+        self.f.flush()
+        self.count += 1
+
+
+class YamlWriter(_Writer):
+    def _write(self, file, data):
+        yaml.dump([{'file': file, 'data': data}], self.f, Dumper=YamlDumper,
+                  default_flow_style=False, allow_unicode=True)
+
+    # 一件も無い場合は、空のリストにする(空のファイルはNoneとして読み込まれる)。
+    def close(self):
+        if self.count == 0 and not self.f.closed:
+            yaml.dump([], self.f, Dumper=YamlDumper)
+        super().close()
+
+
+class JsonlWriter(_Writer):
+    def _write(self, file, data):
+        self.f.write(json.dumps({'file': file, 'data': data}, ensure_ascii=False) + '\n')
+
+
+# 辞書を(キーのタプル, 値)に平らにする。キーはソートする。
+def _flatten(data, keys=()):
+    if isinstance(data, dict):
+        for k in sorted(data, key=str):
+            yield from _flatten(data[k], keys + (k,))
+    else:
+        yield keys, data
+
+
+class CsvWriter(_Writer):
+    def __init__(self, fp_out, key_columns=(), row_fnc=None):
+        """ Constructor
+        :param fp_out: 出力ファイル
+        :param key_columns: 辞書のキーの列の名称。例：タグの数は('tag',)、件数だけの場合は()
+        :param row_fnc: 結果から(キー..., 件数)のタプルを返す関数。Noneの場合は辞書のキーをソートして平らにする。
+        """
+        super().__init__(fp_out)
+        self.key_columns = tuple(key_columns)
+        self.row_fnc = row_fnc
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(['file', *self.key_columns, 'count'])
+
+    # 結果がNone(パーシングの失敗等)の場合は、キーと件数が空の行を書く。
+    def _write(self, file, data):
+        if self.row_fnc is not None:
+            for row in self.row_fnc(data):
+                self.writer.writerow([file, *row])
+            return
+        n = len(self.key_columns)
+        if data is None:
+            self.writer.writerow([file] + [''] * (n + 1))
+            return
+        for keys, value in _flatten(data):
+            keys = (keys + ('',) * n)[:n]
+            self.writer.writerow([file, *keys, value])
+
+
+class RowCsvWriter(_Writer):
+    def __init__(self, fp_out, row_columns):
+        """ Constructor
+        :param fp_out: 出力ファイル
+        :param row_columns: 結果の辞書のキー。例：検証のエラーは('line', 'column', 'message')
+        """
+        super().__init__(fp_out)
+        self.row_columns = tuple(row_columns)
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(['file', *self.row_columns])
+
+    def _write(self, file, data):
+        for row in data:
+            self.writer.writerow([file, *(row.get(k) for k in self.row_columns)])
+
+
+# 形式と拡張子
+FORMATS = {'yaml': '.yml', 'jsonl': '.jsonl', 'csv': '.csv'}
+
+
+def open_writer(fmt, fp_out_wo_ext, key_columns=(), row_columns=None, row_fnc=None):
+    """ 形式に応じたライターを開く。
+    :param fmt: FORMATSのキー
+    :param fp_out_wo_ext: 拡張子無しの出力ファイル
+    :param key_columns: CSVの場合の、キーの列の名称
+    :param row_columns: CSVの場合で、結果が辞書のリストの場合の列の名称(RowCsvWriter)
+    :param row_fnc: CSVの場合の、結果から行を作る関数(CsvWriterを参照)
+    """
+    fp_out = fp_out_wo_ext + FORMATS[fmt]
+    if fmt == 'csv' and row_columns is not None:
+        return RowCsvWriter(fp_out, row_columns=row_columns)
+    elif fmt == 'csv':
+        return CsvWriter(fp_out, key_columns=key_columns, row_fnc=row_fnc)
+    elif fmt == 'jsonl':
+        return JsonlWriter(fp_out)
+    else:
+        return YamlWriter(fp_out)
+
+
+class Prompt:
+    @staticmethod
+    def get_format(msg=f'Output Format ({"/".join(FORMATS)}): '):
+        while True:
+            s = input(msg)
+            if s in FORMATS:
+                return s
+            else:
+                print('Input Invalid')
@@ -1,6 +1,38 @@
 """
 XML
+
+■　プロセスプール
+    lxmlのパーシングはCPUを使うので、map_files()でファイルをプロセスプールに渡す。
+    ワーカーにはツリーではなく、小さな結果(エラーメッセージ、タグの数の辞書、件数)だけを返させる。
+    結果は、渡したファイルの順番で返すので、シリアルで実行した場合と同じ出力になる。
+
+■　ストリーミング
+    STREAM_SIZE以上のファイルは、ツリーを作らずにXmlStream(etree.iterparse)で読み込む。
+    処理が終わった要素は消去するので、ファイルのサイズに関わらずメモリの使用量は一定になる。
+    XPathは、StreamPathが対応している範囲(子「/」と子孫「//」のステップ、属性の述語)だけ。
+    対応していない式の場合は、大きなファイルでもツリーを作って数える。
+
+■　クエリセット
+    get_query_counts()は、一つのファイルを一回だけ読み込んで、タグの数と複数のXPathの件数を数える。
+    XPathはcompile_xpath()でプロセス毎に一回だけコンパイルする(etree.XPathはpickleできないので、文字列で渡す)。
+
+■　整形
+    整形したバイト列が既存のファイルと同じ場合は書き込まない(更新日時が変わらないので、同期の対象にならない)。
+    書き込む場合は、一時ファイルに書いてからos.replace()で置き換えるので、途中で止まっても壊れたXMLが残らない。
+
+■　スキーマ検証
+    スキーマ(.xsd: XMLSchema、.rng: RelaxNG)はload_schema()でプロセス毎に一回だけコンパイルする。
+    get_schema_stamp()の、スキーマとinclude/importで読み込むファイルの更新日時もキーにするので、
+    どれかを修正した場合はコンパイルし直す(URLで読み込むファイルは対象外)。
+    エラーの行番号を返す為に、大きなファイルでもツリーを作って検証する(iterparseで検証すると行番号が0になる)。
 """
+import os
+import re
+import tempfile
+import functools
+import itertools
+import collections
+import concurrent.futures
 from lxml import etree
 from collections import Counter
 
@@ -16,8 +48,9 @@ except ImportError:
 class Xml:
     def __init__(self, fp_in):
         # ファイルを開いてパーシングする
+        # 開けなかった場合はOSError
+        f = open(fp_in, 'rb')
         try:
-            f = open(fp_in, 'rb')
             t = etree.parse(f)
         # 失敗したらエラーメッセージを格納する。
         except etree.XMLSyntaxError as e:
@@ -32,32 +65,506 @@ class Xml:
         finally:
             f.close()
 
-    def pretty_write_utf8(self, fp_out):
-        # UTF8でファイルに書き出す。
-        if self.tree:
-            # 関数の名前は、tostring()だが、返すデータタイプはバイトである。
-            # ファイルに書き出す時は open(fp, 'w')ではなく、open(fp, 'w')にする必要がある。
-            data = etree.tostring(self.tree, pretty_print=True, xml_declaration=True, encoding='utf-8')
-
-            try:
-                with open(fp_out, 'wb') as f:
-                    f.write(data)
-            except PermissionError as e:
-                print(e)
-                input('Permission error occurred. Press enter to continue...')
-        else:
-            print(f'ERROR: Cannot write file. self.tree is None.')
+    def to_pretty_utf8(self):
+        # 関数の名前は、tostring()だが、返すデータタイプはバイトである。
+        # ファイルに書き出す時は open(fp, 'w')ではなく、open(fp, 'wb')にする必要がある。
+        return etree.tostring(self.tree, pretty_print=True, xml_declaration=True, encoding='utf-8')
 
     def count_tag_names(self):
         # Elementの名前の数を集計する。
-        tags = [i.tag for i in self.tree.xpath('//*')]
-        return Counter(tags)
+        # 「//*」と同じ順番・同じ要素だが、リストを作らない。
+        return Counter(i.tag for i in self.tree.iter(etree.Element))
 
     def count_by_xpath(self, xpath):
-        return len(self.tree.xpath(xpath))
+        return to_count(compile_xpath(xpath)(self.tree))
+
+
+# 一時ファイルの拡張子
+TMP_EXT = '.sendto.part'
+
+# 整形の結果
+PRETTY_WRITTEN = 'written'
+PRETTY_UNCHANGED = 'unchanged'
+
+
+# 既存のファイルの中身が、バイト列と同じか？
+def is_same_bytes(fp, data):
+    try:
+        if os.path.getsize(fp) != len(data):
+            return False
+        with open(fp, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+# 一時ファイルに書き込んでから置き換える。失敗したら一時ファイルを削除する。
+def write_atomic(fp_out, data):
+    # 一時ファイルの名称は書き込み毎に一意にして、同じ出力ファイルへの書き込みと衝突しないようにする。
+    fd, fp_tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fp_out)),
+                                  prefix=os.path.basename(fp_out) + '.', suffix=TMP_EXT)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp()は所有者だけが読み書きできるので、既存のファイルか既定のパーミッションに合わせる。
+        _copy_mode(fp_out, fp_tmp)
+        os.replace(fp_tmp, fp_out)
+    except BaseException:
+        if os.path.exists(fp_tmp):
+            os.remove(fp_tmp)
+        raise
+
+
+def _copy_mode(fp_src, fp_dst):
+    try:
+        mode = os.stat(fp_src).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(fp_dst, mode)
+
+
+# 書き込んだらTrue、skip_unchangedがTrueで既存のファイルと同じだったらFalse
+def write_if_changed(fp_out, data, skip_unchanged=True):
+    if skip_unchanged and is_same_bytes(fp_out, data):
+        return False
+    write_atomic(fp_out, data)
+    return True
+
+
+# XPathの式をコンパイルする。同じ式はプロセス毎に一回だけコンパイルする。
+@functools.lru_cache(maxsize=256)
+def compile_xpath(xpath):
+    return etree.XPath(xpath)
+
+
+# XPathの結果を件数にする。
+# 「count(//a)」のように、数値・真偽値・文字列を返す式の場合は、その値のまま。
+def to_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, float) and result.is_integer():
+        return int(result)
+    return result
+
+
+# スキーマの拡張子とクラス
+SCHEMA_TYPES = {'.XSD': etree.XMLSchema, '.RNG': etree.RelaxNG}
+
+# 一つのファイルで返すエラーの最大件数(プロセス間で渡す結果を小さくする為)
+MAX_ERRORS = 100
+
+
+def is_schema(fp):
+    return os.path.splitext(fp)[1].upper() in SCHEMA_TYPES
+
+
+# スキーマが読み込む他のファイルの参照(XMLSchemaのinclude/import/redefine/override、RelaxNGのinclude/externalRef)
+XPATH_SCHEMA_REF = etree.XPath(
+    '//xs:include/@schemaLocation | //xs:import/@schemaLocation | //xs:redefine/@schemaLocation'
+    ' | //xs:override/@schemaLocation | //rng:include/@href | //rng:externalRef/@href',
+    namespaces={'xs': 'http://www.w3.org/2001/XMLSchema', 'rng': 'http://relaxng.org/ns/structure/1.0'})
+
 
+def get_schema_stamp(fp_schema):
+    """ スキーマと、スキーマが読み込むファイルの(絶対パス, 更新日時)のタプル
+    読み込むファイルを辿るので、検証の前に一回だけ呼んで、validate_file()に渡す。
+    URL(「http://」等)で読み込むファイルは含まない。見つからないファイルの更新日時はNone
+    """
+    stamp = {}
+    stack = [os.path.abspath(fp_schema)]
+    while stack:
+        fp = stack.pop()
+        if fp in stamp:
+            continue
+        try:
+            stamp[fp] = os.path.getmtime(fp)
+            tree = etree.parse(fp)
+        except OSError:
+            stamp[fp] = None
+            continue
+        except etree.XMLSyntaxError:
+            continue
+        for ref in XPATH_SCHEMA_REF(tree):
+            if '://' not in ref:
+                stack.append(os.path.abspath(os.path.join(os.path.dirname(fp), ref)))
+    return tuple(sorted(stamp.items()))
+
+
+@functools.lru_cache(maxsize=16)
+def _load_schema(fp_schema, stamp):
+    return SCHEMA_TYPES[os.path.splitext(fp_schema)[1].upper()](etree.parse(fp_schema))
+
+
+# スキーマをコンパイルする。同じスキーマはプロセス毎に一回だけコンパイルする。
+# stampはget_schema_stamp()の戻り値。Noneの場合は、ここで取得する。
+# 失敗したらetree.XMLSyntaxErrorかetree.XMLSchemaParseError(RelaxNGParseError)
+def load_schema(fp_schema, stamp=None):
+    if not is_schema(fp_schema):
+        raise ValueError(f'schema must be one of {", ".join(SCHEMA_TYPES).lower()}: {fp_schema}')
+    if stamp is None:
+        stamp = get_schema_stamp(fp_schema)
+    return _load_schema(os.path.abspath(fp_schema), stamp)
+
+
+# ResultCacheのクエリ。スキーマか、読み込むファイルの更新日時が変わったら、別の結果になる。
+def get_schema_query(fp_schema, stamp):
+    return f'schema:{os.path.abspath(fp_schema)}:' + ','.join(str(mtime) for fp, mtime in stamp)
+
+
+# エラーログを{'line', 'column', 'message'}のリストにする。
+def to_error_lst(error_log):
+    return [{'line': e.line, 'column': e.column, 'message': e.message}
+            for e in itertools.islice(error_log, MAX_ERRORS)]
+
+
+# プロセスプールに一度に渡すファイル数
+CHUNK_SIZE = 64
+
+# このサイズ以上のファイルは、ストリーミングで読み込む。
+STREAM_SIZE = 256 * 1024 ** 2
+
+# StreamPathのステップ
+# 「/」もしくは「//」、名称もしくは「*」、属性の述語「[@id]」「[@type="a"]」「[@type!='a']」
+RGX_STEP = re.compile(r"""(//?)([\w.\-]+|\*)((?:\[@[\w.\-]+(?:\s*!?=\s*(?:"[^"]*"|'[^']*'))?\])*)""")
+RGX_PREDICATE = re.compile(r"""\[@([\w.\-]+)(?:\s*(!?=)\s*(?:"([^"]*)"|'([^']*)'))?\]""")
+
+
+class StreamPath:
+    """ XmlStreamで使う、XPathのサブセット
+    例：「/root/item」「//item[@type="a"]」「/root//item[@id]/name」
+    対応していない式の場合はValueError
+    """
+    def __init__(self, xpath):
+        self.xpath = xpath
+        # (子孫か？, 名称(「*」はNone), 述語のリスト)のリスト
+        self.steps = []
+        pos = 0
+        for m in RGX_STEP.finditer(xpath):
+            if m.start() != pos:
+                break
+            is_desc = m.group(1) == '//'
+            name = None if m.group(2) == '*' else m.group(2)
+            pred_lst = [(p[0], p[1], p[2] if p[2] else p[3]) for p in RGX_PREDICATE.findall(m.group(3))]
+            self.steps.append((is_desc, name, pred_lst))
+            pos = m.end()
+        if pos != len(xpath) or len(self.steps) == 0:
+            raise ValueError(f'XPath "{xpath}" is not supported in streaming mode.')
+
+    @staticmethod
+    def _test_step(step, elem):
+        is_desc, name, pred_lst = step
+        if name is not None and elem.tag != name:
+            return False
+        for attr, op, value in pred_lst:
+            v = elem.get(attr)
+            if op == '':
+                if v is None:
+                    return False
+            elif op == '=':
+                if v != value:
+                    return False
+            elif v is None or v == value:
+                return False
+        return True
+
+    # i番目のステップを、stack[j]以降の要素に合致させる。最後のステップは、stackの最後の要素に合致しなければならない。
+    def _match(self, stack, i, j):
+        step = self.steps[i]
+        for k in (range(j, len(stack)) if step[0] else [j]):
+            if k >= len(stack) or not self._test_step(step, stack[k]):
+                continue
+            if i == len(self.steps) - 1:
+                if k == len(stack) - 1:
+                    return True
+            elif self._match(stack, i + 1, k + 1):
+                return True
+        return False
+
+    def match(self, stack):
+        """ :param stack: ルートから現在の要素までの要素のリスト"""
+        return self._match(stack, 0, 0)
+
+
+def is_stream_path(xpath):
+    try:
+        StreamPath(xpath)
+    except ValueError:
+        return False
+    return True
+
+
+class XmlStream:
+    """ツリーを作らずにetree.iterparseで読み込む。Xmlと違い、メソッドを呼ぶ度にファイルを読み込む。"""
+    def __init__(self, fp_in):
+        self.fp_in = fp_in
+        self.err = None
+
+    # 要素の開始毎に、ルートからの要素のリストを渡してfnc_start()を呼ぶ。
+    # 終了した要素は消去して、処理済みの兄弟も親から削除する。
+    def _iterparse(self, fnc_start=None):
+        stack = []
+        try:
+            for event, elem in etree.iterparse(self.fp_in, events=('start', 'end'), huge_tree=True):
+                if event == 'start':
+                    stack.append(elem)
+                    if fnc_start is not None:
+                        fnc_start(stack)
+                else:
+                    stack.pop()
+                    elem.clear(keep_tail=True)
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        except etree.XMLSyntaxError as e:
+            print(f"""ERROR: failed to parse {self.fp_in}.""")
+            self.err = e
+            return False
+        self.err = None
+        return True
+
+    # 成功したらTrue
+    def check(self):
+        return self._iterparse()
+
+    # 失敗したらNone
+    def count_tag_names(self):
+        counter = Counter()
+        if self._iterparse(lambda stack: counter.update([stack[-1].tag])):
+            return counter
+        return None
 
-def yield_fp(path_in):
+    # 失敗したらNone
+    def count_by_xpath(self, xpath):
+        result = self.count_queries([xpath], count_tags=False)
+        return result['xpath'][xpath] if result is not None else None
+
+    # 一回の読み込みで、タグの数と複数のXPathの件数を数える。get_query_counts()と同じ辞書を返す。
+    # 失敗したらNone
+    def count_queries(self, xpath_lst, count_tags=True):
+        path_lst = [StreamPath(xpath) for xpath in xpath_lst]
+        counts = [0] * len(path_lst)
+        counter = Counter()
+
+        def fnc_start(stack):
+            if count_tags:
+                counter[stack[-1].tag] += 1
+            for i, path in enumerate(path_lst):
+                if path.match(stack):
+                    counts[i] += 1
+
+        if not self._iterparse(fnc_start):
+            return None
+        result = {'xpath': dict(zip(xpath_lst, counts))}
+        if count_tags:
+            result['tags'] = dict(counter)
+        return result
+
+
+def is_large(fp):
+    return os.path.getsize(fp) >= STREAM_SIZE
+
+
+# ---------------------------------------------------------------------------------
+# map_files()に渡す関数
+# プロセスプールで実行されるので、モジュールの関数にする(内部関数やlambdaはpickleできない)。
+
+# 大きなファイルは、自動でストリーミングで読み込む。
+# 走査後に削除・ロックされたファイルのOSErrorは、そのファイルの失敗として返す(実行全体を止めない)。
+
+# パーシングに失敗したらエラーメッセージ、成功したらNone
+def check_file(fp):
+    try:
+        if is_large(fp):
+            obj = XmlStream(fp)
+            obj.check()
+        else:
+            obj = Xml(fp)
+    except OSError as e:
+        return str(e)
+    return str(obj.err) if obj.err else None
+
+
+# パーシングに失敗したらNone
+def get_tag_count(fp):
+    try:
+        if is_large(fp):
+            counter = XmlStream(fp).count_tag_names()
+            return dict(counter) if counter is not None else None
+        obj = Xml(fp)
+    except OSError as e:
+        print(f'ERROR: failed to read {fp}. {e}')
+        return None
+    return dict(obj.count_tag_names()) if obj.err is None else None
+
+
+# パーシングに失敗したらNone
+def get_xpath_count(fp, xpath):
+    try:
+        if is_large(fp) and is_stream_path(xpath):
+            return XmlStream(fp).count_by_xpath(xpath=xpath)
+        obj = Xml(fp)
+    except OSError as e:
+        print(f'ERROR: failed to read {fp}. {e}')
+        return None
+    return obj.count_by_xpath(xpath=xpath) if obj.err is None else None
+
+
+# スキーマで検証して、エラーのリストを返す(to_error_lst()を参照)。妥当な場合は空のリスト
+# パーシングに失敗した場合も、その位置をエラーとして返す。
+# stampはget_schema_stamp()の戻り値。ファイル毎に取得しないように、呼び出し元で一回だけ取得して渡す。
+def validate_file(fp, fp_schema, stamp):
+    schema = load_schema(fp_schema, stamp=stamp)
+    # 例外のerror_logは、それまでのエラーも溜まっているので、パーサーのerror_logを使う。
+    parser = etree.XMLParser(huge_tree=True)
+    try:
+        tree = etree.parse(fp, parser)
+    except etree.XMLSyntaxError as e:
+        return to_error_lst(parser.error_log) or [{'line': e.lineno, 'column': e.offset, 'message': e.msg}]
+    except OSError as e:
+        return [{'line': None, 'column': None, 'message': str(e)}]
+    if schema.validate(tree):
+        return []
+    return to_error_lst(schema.error_log)
+
+
+# fp_in_outは(入力ファイル, 出力ファイル)。上書きする場合は同じパス
+# 戻り値はPRETTY_WRITTENかPRETTY_UNCHANGED、失敗したらエラーメッセージ
+def prettify_file(fp_in_out, skip_unchanged=True):
+    fp_in, fp_out = fp_in_out
+    try:
+        obj = Xml(fp_in)
+    except OSError as e:
+        return f'ERROR: failed to read. {e}'
+    if obj.err is not None:
+        return f'ERROR: failed to parse. {obj.err}'
+    try:
+        written = write_if_changed(fp_out, obj.to_pretty_utf8(), skip_unchanged=skip_unchanged)
+    except OSError as e:
+        return f'ERROR: failed to write. {e}'
+    return PRETTY_WRITTEN if written else PRETTY_UNCHANGED
+
+
+# 一回の読み込みで、タグの数と複数のXPathの件数を数える。
+# 戻り値は{'tags': {タグ: 数}, 'xpath': {式: 件数}}。パーシングに失敗したらNone
+def get_query_counts(fp, xpath_tpl, count_tags=True):
+    try:
+        if is_large(fp) and all(is_stream_path(xpath) for xpath in xpath_tpl):
+            return XmlStream(fp).count_queries(xpath_tpl, count_tags=count_tags)
+        obj = Xml(fp)
+    except OSError as e:
+        print(f'ERROR: failed to read {fp}. {e}')
+        return None
+    if obj.err is not None:
+        return None
+    result = {'xpath': {xpath: obj.count_by_xpath(xpath) for xpath in xpath_tpl}}
+    if count_tags:
+        result['tags'] = dict(obj.count_tag_names())
+    return result
+
+
+# ---------------------------------------------------------------------------------
+
+
+# get_query_counts()の結果を、CSVの(type, name, count)の行にする。hrpt.CsvWriterのrow_fncに渡す。
+# typeは「xpath」(入力した順番)と「tag」(名称の順番)。パーシングに失敗したファイルはtypeが「error」
+def get_query_rows(data):
+    if data is None:
+        yield 'error', '', ''
+        return
+    for xpath, count in data['xpath'].items():
+        yield 'xpath', xpath, count
+    for tag, count in sorted(data.get('tags', {}).items()):
+        yield 'tag', tag, count
+
+
+def _apply_chunk(fnc, chunk):
+    return [(key, fnc(fp)) for key, fp in chunk]
+
+
+def map_files(fnc, item_itr, workers=1, chunk_size=CHUNK_SIZE, lookup=None):
+    """ (キー, ファイルパス)を受けて、(キー, fnc(ファイルパス))を受けた順番で返すジェネレータ
+    :param fnc: ファイルパスを受ける関数。workersが2以上の場合は、pickleできる関数
+    :param item_itr: (キー, ファイルパス)のイテラブル。ファイルパスの代わりに、fncが受けるタプル等でもよい。
+    :param workers: プロセス数。1の場合は、このプロセスで順番に実行する。
+    :param chunk_size: 一度にプロセスに渡すファイル数
+    :param lookup: (キー, ファイルパス)を受けて(見つかったか？, 結果)を返す関数(hcache.ResultCache.map()等)。
+                   見つかった場合はfncを実行せずにその結果を返す。このプロセスで入力の順番に呼ぶ。
+    """
+    if lookup is None:
+        lookup = _not_found
+
+    if workers <= 1:
+        for key, fp in item_itr:
+            found, value = lookup(key, fp)
+            yield key, value if found else fnc(fp)
+        return
+
+    # 入力の順番に並べた(キー, 結果, チャンク, チャンク内の位置)。結果が出ている項目はチャンクがNone。
+    # チャンクは[Future, 返していない件数]。Futureは送るまでNone。
+    window = collections.deque()
+    # メモリを使い過ぎないように、実行中のチャンクはworkersの2倍まで、並べる項目はその件数までにする。
+    max_running = workers * 2
+    max_window = max_running * chunk_size
+    item_itr = iter(item_itr)
+    running = 0
+    exhausted = False
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # 結果が出ている先頭の項目は、後の入力を待たずに返す。
+            while window and window[0][2] is None:
+                key, value, _, _ = window.popleft()
+                yield key, value
+
+            chunk, items = None, []
+            while not exhausted and running < max_running and len(window) < max_window:
+                item = next(item_itr, None)
+                if item is None:
+                    exhausted = True
+                    break
+                key, fp = item
+                found, value = lookup(key, fp)
+                if found:
+                    # 前に解析中の項目が無ければ、すぐに返す。
+                    if window:
+                        window.append((key, value, None, None))
+                    else:
+                        yield key, value
+                    continue
+                if chunk is None:
+                    chunk = [None, 0]
+                window.append((key, None, chunk, len(items)))
+                items.append(item)
+                if len(items) == chunk_size:
+                    chunk[0], chunk[1] = pool.submit(_apply_chunk, fnc, items), len(items)
+                    running += 1
+                    chunk, items = None, []
+            if items:
+                chunk[0], chunk[1] = pool.submit(_apply_chunk, fnc, items), len(items)
+                running += 1
+
+            if len(window) == 0:
+                if exhausted:
+                    break
+                continue
+            # 先頭は解析中の項目なので、そのチャンクの終了を待つ。
+            key, _, chunk, i = window[0]
+            if chunk is None:
+                continue
+            window.popleft()
+            yield key, chunk[0].result()[i][1]
+            chunk[1] -= 1
+            if chunk[1] == 0:
+                running -= 1
+
+
+def _not_found(key, fp):
+    return False, None
+
+
+# scan_fncは、hpath.Dir.scan()と同じ引数でEntryを返す関数(sendtocli.Cli._get_scan_fnc()等)。
+# Noneの場合はhpath.Dir.scan()を使う。
+def yield_fp(path_in, scan_fnc=None):
     path_type = hpath.get_path_type(path_in)
     # 渡されたパスがファイルの場合はスルーパスする。
     # 拡張子が.xmlじゃなくてもOKとする。
@@ -66,9 +573,11 @@ def yield_fp(path_in):
     # 渡されたパスがフォルダの場合はファイルを再帰検索し
     # 拡張子が.XMLだったらパスを返す。
     elif path_type == 'dir':
-        for fp in hpath.Dir(path=path_in).mapper():
-            if hpath.File(fp).ext_upper == '.XML':
-                yield fp
+        if scan_fnc is None:
+            scan_fnc = hpath.Dir(path=path_in).scan
+        for entry in scan_fnc():
+            if entry.ext_upper == '.XML':
+                yield entry.path
     # 渡されたパスが不適切な場合は例外にすｒ。
     else:
         raise ValueError('Invalid Input')
@@ -88,18 +597,68 @@ def get_xpath(msg='XPath: '):
             return s
 
 
-def _format_files(path_in):
-    for fp in yield_fp(path_in=path_in):
-        Xml(fp).pretty_write_utf8(fp)
-        print('formatted:', fp)
+# スキーマファイル(.xsd/.rng)を受けて、コンパイルできたらパスを返す。
+def get_schema(msg='Schema File (.xsd/.rng): '):
+    while True:
+        s = input(msg).replace('"', '')
+        try:
+            load_schema(s)
+        except (OSError, ValueError, etree.XMLSyntaxError, etree.XMLSchemaParseError, etree.RelaxNGParseError) as e:
+            print(f'Schema {s} could not be compiled.')
+            print('Exception:', e)
+        else:
+            return s
+
+
+# 空の入力までXPathを受けて、リストを返す。
+def get_xpath_lst(msg='XPath (empty to finish): '):
+    xpath_lst = []
+    while True:
+        s = input(msg)
+        if s == '':
+            return xpath_lst
+        try:
+            compile_xpath(s)
+        except etree.XPathError as e:
+            print(f'Xpath{s} parsing failed with error.')
+            print('Exception:', e)
+        else:
+            xpath_lst.append(s)
+
+
+def _format_files(path_in, workers=1):
+    item_itr = ((fp, (fp, fp)) for fp in yield_fp(path_in=path_in))
+    for fp, status in map_files(prettify_file, item_itr, workers):
+        print(f'{status}:', fp)
+
+
+# エラーを「ファイル:行:列: メッセージ」で表示して、妥当でないファイル数を返す。
+def _validate_files(path_in, fp_schema, workers=1):
+    stamp = get_schema_stamp(fp_schema)
+    load_schema(fp_schema, stamp=stamp)
+    count_invalid = 0
+    item_itr = ((fp, fp) for fp in yield_fp(path_in=path_in))
+    fnc = functools.partial(validate_file, fp_schema=fp_schema, stamp=stamp)
+    for fp, error_lst in map_files(fnc, item_itr, workers):
+        count_invalid += len(error_lst) > 0
+        for e in error_lst:
+            print(f'{fp}:{e["line"]}:{e["column"]}: {e["message"]}')
+    return count_invalid
 
 
 def main():
+    import sys
     import argparse
     parser = argparse.ArgumentParser(description='Compress files in a folder')
     parser.add_argument('-i', '--path_in', type=str, help='Input Path')
+    parser.add_argument('-w', '--workers', type=int, help='Processes (1=serial)')
+    parser.add_argument('-s', '--schema', type=str, help='Validate with XSD/RelaxNG instead of formatting')
+    parser.set_defaults(workers=1)
     args = parser.parse_args()
-    _format_files(args.path_in)
+    if args.schema:
+        # 妥当でないファイルがあれば、終了コードを1にする。
+        sys.exit(1 if _validate_files(args.path_in, args.schema, workers=args.workers) else 0)
+    _format_files(args.path_in, workers=args.workers)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+"""
+ZIP
+フォルダをZIPファイルに圧縮する。
+
+■　shutil.make_archive()との違い
+    shutil.make_archive()は、プロセス全体のCWDを変更するので、同時に複数の圧縮を実行できない。
+    ここでは、zipfileに相対パス(arcname)を渡すので、CWDを変更しない。
+    なので、子フォルダ毎の圧縮を、プロセスプールで同時に実行できる。
+
+■　圧縮方法の選択
+    JPEG、MP4、ZIP、7zの分割ファイル等の既に圧縮されているファイルは、Deflateしてもサイズが小さくならず、CPUを浪費する。
+    なので、ファイル毎に以下の順番で判定して、圧縮できないファイルは無圧縮(ZIP_STORED)で格納する。
+        1. 拡張子がSTORED_EXTSに含まれる、もしくは「.001」のような分割ファイル
+        2. 先頭ブロックのエントロピー(1バイト当たりのビット数)がENTROPY_LIMIT以上
+    圧縮レベルは、LEVELSから選ぶ(fast/balanced/max)。
+
+■　更新
+    update_zip()は、既存のZIPファイルのセントラルディレクトリと入力フォルダを比較して、変わったメンバーだけを圧縮する。
+"""
+import os
+import re
+import copy
+import math
+import time
+import struct
+import zipfile
+import collections
+import concurrent.futures
+
+# 圧縮レベル(Deflate)
+LEVELS = {'fast': 1, 'balanced': 6, 'max': 9}
+
+# 既に圧縮されているファイルの拡張子
+STORED_EXTS = {
+    # 画像
+    '.JPG', '.JPEG', '.PNG', '.GIF', '.WEBP', '.HEIC',
+    # 動画・音声
+    '.MP4', '.MOV', '.MKV', '.AVI', '.WMV', '.M4V', '.MP3', '.M4A', '.AAC', '.OGG', '.FLAC',
+    # 圧縮ファイル
+    '.ZIP', '.7Z', '.RAR', '.GZ', '.TGZ', '.BZ2', '.XZ', '.ZST', '.LZMA', '.CAB',
+    # 中身がZIPのファイル
+    '.DOCX', '.XLSX', '.PPTX', '.JAR', '.APK',
+}
+
+# 「.001」のような分割ファイルの拡張子
+RGX_VOLUME_EXT = re.compile(r'\.[0-9]{3}$')
+
+# エントロピーを計算する先頭ブロックのサイズ
+SAMPLE_SIZE = 64 * 1024
+
+# このサイズ未満のファイルは、判定せずに圧縮する。
+SAMPLE_MIN_SIZE = 4 * 1024
+
+# 無圧縮にするエントロピー(ビット/バイト)の下限。8が完全にランダム。
+ENTROPY_LIMIT = 7.5
+
+# update_zip()で、更新日時を同じとみなす誤差(秒)。ZIPの更新日時は2秒単位
+MTIME_TOLERANCE = 2.0
+
+# update_zip()で、圧縮データをコピーする時の読み込みサイズ
+COPY_CHUNK_SIZE = 1024 ** 2
+
+# 作り直す時の一時ファイルの拡張子
+TMP_EXT = '.sendto.part'
+
+# 圧縮の予定
+# fp_out_wo_extは、拡張子無しの出力ファイルの絶対パス(shutil.make_archive()のbase_nameと同じ)
+# levelは、LEVELSのキー
+# updateがTrueの場合は、既存のZIPファイルを更新する(update_zip())。
+Job = collections.namedtuple('Job', ['dir_in', 'fp_out_wo_ext', 'level', 'update'], defaults=['balanced', False])
+
+# 圧縮の結果
+# errは、失敗した場合のエラーメッセージ。成功した場合はNone
+Result = collections.namedtuple('Result', ['dir_in', 'fp_out', 'size_in', 'size_out', 'seconds', 'err'])
+
+
+# 先頭ブロックのエントロピー(ビット/バイト)
+def get_entropy(data):
+    n = len(data)
+    if n == 0:
+        return 0.0
+    return -sum(c / n * math.log2(c / n) for c in collections.Counter(data).values())
+
+
+# 圧縮しても小さくならないファイルか？
+def is_incompressible(fp, size=None):
+    ext = os.path.splitext(fp)[1].upper()
+    if ext in STORED_EXTS or RGX_VOLUME_EXT.search(ext):
+        return True
+    if size is None:
+        size = os.path.getsize(fp)
+    if size < SAMPLE_MIN_SIZE:
+        return False
+    with open(fp, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    return get_entropy(sample) >= ENTROPY_LIMIT
+
+
+# フォルダの中身を(ファイルパス, arcname, フォルダか？)で返すジェネレータ
+# 出力ファイル自身が入力フォルダの中にある場合は除く。
+def _yield_members(dir_in, fp_out):
+    fp_out_abs = os.path.abspath(fp_out)
+    for root, dirs, files in os.walk(dir_in):
+        dirs.sort()
+        rel_root = os.path.relpath(root, dir_in)
+        # フォルダも登録しておくと、空のフォルダも復元される。
+        if rel_root != os.curdir:
+            yield root, rel_root, True
+        for fn in sorted(files):
+            fp = os.path.join(root, fn)
+            if os.path.abspath(fp) in (fp_out_abs, fp_out_abs + TMP_EXT):
+                continue
+            yield fp, os.path.normpath(os.path.join(rel_root, fn)), False
+
+
+# ファイルを一つ格納して、圧縮前のバイト数を返す。
+def _write_member(zf, fp, arcname, is_dir):
+    if is_dir:
+        zf.write(fp, arcname=arcname)
+        return 0
+    size = os.path.getsize(fp)
+    if is_incompressible(fp, size):
+        zf.write(fp, arcname=arcname, compress_type=zipfile.ZIP_STORED)
+    else:
+        zf.write(fp, arcname=arcname)
+    return size
+
+
+def make_zip(dir_in, fp_out_wo_ext, level='balanced'):
+    """ フォルダの中身をZIPファイルに圧縮して、出力ファイルのパスを返す。
+    shutil.make_archive(base_name=fp_out_wo_ext, format='zip', root_dir=dir_in)と同じ構成のZIPファイルを作る。
+    圧縮できないファイルは無圧縮で格納する。
+    :param level: LEVELSのキー
+    :return: (出力ファイルのパス, 圧縮前のバイト数)
+    """
+    fp_out = fp_out_wo_ext + '.zip'
+    size_in = 0
+    with zipfile.ZipFile(fp_out, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=LEVELS[level]) as zf:
+        for fp, arcname, is_dir in _yield_members(dir_in, fp_out):
+            size_in += _write_member(zf, fp, arcname, is_dir)
+    return fp_out, size_in
+
+
+# ZIPの中のファイル名称(区切りは「/」、フォルダは「/」で終わる)
+def _to_zip_name(arcname, is_dir):
+    name = arcname.replace(os.sep, '/')
+    return name + '/' if is_dir else name
+
+
+# 既存のメンバーが、入力ファイルと同じか？
+# ZIPの更新日時は2秒単位のローカル時刻なので、2秒の誤差を許す。
+def _is_unchanged(info, fp, is_dir):
+    if is_dir:
+        return True
+    st = os.stat(fp)
+    if info.file_size != st.st_size:
+        return False
+    ts = time.mktime(info.date_time + (0, 0, -1))
+    return abs(ts - st.st_mtime) <= MTIME_TOLERANCE
+
+
+# ZIP64の拡張フィールドを除く。FileHeader()が必要に応じて追加する。
+def _strip_zip64_extra(extra):
+    result = b''
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[i:i + 4])
+        if header_id != 1:
+            result += extra[i:i + 4 + size]
+        i += 4 + size
+    return result
+
+
+# 圧縮済みのデータを展開せずに、そのまま別のZIPファイルにコピーする。
+def _copy_raw(zf_src, zf_dst, info):
+    # ローカルヘッダーの後ろからデータが始まる。
+    fp_src = zf_src.fp
+    fp_src.seek(info.header_offset)
+    header = fp_src.read(zipfile.sizeFileHeader)
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    fp_src.seek(info.header_offset + zipfile.sizeFileHeader + name_len + extra_len)
+
+    # データディスクリプタは使わずに、ローカルヘッダーにサイズとCRCを書く。
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~0x08
+    new_info.extra = _strip_zip64_extra(info.extra)
+    new_info.header_offset = zf_dst.fp.tell()
+    zf_dst.fp.write(new_info.FileHeader())
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = fp_src.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f'{info.filename} is truncated.')
+        zf_dst.fp.write(chunk)
+        remaining -= len(chunk)
+
+    # 次のメンバーと、セントラルディレクトリの書き込み位置を更新する。
+    zf_dst.start_dir = zf_dst.fp.tell()
+    zf_dst.filelist.append(new_info)
+    zf_dst.NameToInfo[new_info.filename] = new_info
+
+
+def update_zip(dir_in, fp_out_wo_ext, level='balanced'):
+    """ 既存のZIPファイルを、フォルダの中身に合わせて更新する。
+    セントラルディレクトリのサイズと更新日時を入力ファイルと比較する。
+        変更無し：何もしない。
+        追加だけ：既存のZIPファイルに追記する。
+        変更・削除あり：変わっていないメンバーは圧縮データのままコピーし、変わったメンバーだけを圧縮して作り直す。
+    ZIPファイルが無い場合や、壊れている場合は、最初から作る。
+    :return: (出力ファイルのパス, 圧縮したバイト数)
+    """
+    fp_out = fp_out_wo_ext + '.zip'
+    if not os.path.isfile(fp_out):
+        return make_zip(dir_in, fp_out_wo_ext, level=level)
+
+    try:
+        zf_src = zipfile.ZipFile(fp_out, 'r')
+    except zipfile.BadZipFile:
+        print(f'WARNING: "{fp_out}" is broken. Rebuilding...')
+        return make_zip(dir_in, fp_out_wo_ext, level=level)
+
+    with zf_src:
+        # 既存のメンバー
+        info_dict = {info.filename: info for info in zf_src.infolist()}
+
+        # 入力ファイルと比較する。
+        member_lst = list(_yield_members(dir_in, fp_out))
+        unchanged = set()
+        for fp, arcname, is_dir in member_lst:
+            name = _to_zip_name(arcname, is_dir)
+            info = info_dict.get(name)
+            if info is not None and _is_unchanged(info, fp, is_dir):
+                unchanged.add(name)
+        added = [m for m in member_lst if _to_zip_name(m[1], m[2]) not in info_dict]
+        # 既存のメンバーの中に、変わったもの、もしくは削除されたものがあるか？
+        rewrite = len(unchanged) < len(info_dict)
+
+        # 変更無し
+        if not rewrite and len(added) == 0:
+            return fp_out, 0
+
+        # 追加だけなら、追記する。
+        if not rewrite:
+            zf_src.close()
+            size_in = 0
+            with zipfile.ZipFile(fp_out, 'a', compression=zipfile.ZIP_DEFLATED, compresslevel=LEVELS[level]) as zf:
+                for fp, arcname, is_dir in added:
+                    size_in += _write_member(zf, fp, arcname, is_dir)
+            return fp_out, size_in
+
+        # 変更・削除あり：一時ファイルに作り直してから、置き換える。
+        size_in = 0
+        fp_tmp = fp_out + TMP_EXT
+        with zipfile.ZipFile(fp_tmp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=LEVELS[level]) as zf:
+            for fp, arcname, is_dir in member_lst:
+                name = _to_zip_name(arcname, is_dir)
+                if name in unchanged:
+                    _copy_raw(zf_src, zf, info_dict[name])
+                else:
+                    size_in += _write_member(zf, fp, arcname, is_dir)
+    os.replace(fp_tmp, fp_out)
+    return fp_out, size_in
+
+
+# プロセスプールで実行する。例外は文字列にして返す。
+def _run_job(job):
+    time_start = time.perf_counter()
+    try:
+        fnc = update_zip if job.update else make_zip
+        fp_out, size_in = fnc(job.dir_in, job.fp_out_wo_ext, level=job.level)
+        size_out = os.path.getsize(fp_out)
+        err = None
+    except (OSError, zipfile.BadZipFile, ValueError) as e:
+        fp_out, size_in, size_out = job.fp_out_wo_ext + '.zip', 0, 0
+        err = f'{type(e).__name__}: {e}'
+    return Result(dir_in=job.dir_in, fp_out=fp_out, size_in=size_in, size_out=size_out,
+                  seconds=time.perf_counter() - time_start, err=err)
+
+
+def run_jobs(job_lst, workers=None):
+    """ 複数の圧縮をプロセスプールで同時に実行する。
+    :param job_lst: Jobのリスト
+    :param workers: 同時に実行するプロセス数。Noneの場合はCPU数。1の場合はプロセスプールを使わない。
+    :return: (Resultのリスト(job_lstと同じ順番), 全体の秒数)
+    """
+    time_start = time.perf_counter()
+    result_lst = []
+    if workers == 1:
+        for job in job_lst:
+            result = _run_job(job)
+            print_result(result)
+            result_lst.append(result)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(_run_job, job_lst):
+                print_result(result)
+                result_lst.append(result)
+    return result_lst, time.perf_counter() - time_start
+
+
+class Prompt:
+    @staticmethod
+    def get_level(msg=f'Compression Level ({"/".join(LEVELS)}): '):
+        while True:
+            s = input(msg)
+            if s in LEVELS:
+                return s
+            else:
+                print('Input Invalid')
+
+
+def print_result(result):
+    if result.err:
+        print(f'ERROR: failed to create "{result.fp_out}". {result.err}')
+    else:
+        mb_in = result.size_in / 1024 ** 2
+        mb_out = result.size_out / 1024 ** 2
+        print(f'Created "{result.fp_out}". {mb_in:.1f} MB -> {mb_out:.1f} MB in {result.seconds:.1f} s')
+
+
+def print_report(result_lst, seconds):
+    ok_lst = [r for r in result_lst if r.err is None]
+    err_lst = [r for r in result_lst if r.err is not None]
+    mb_in = sum(r.size_in for r in ok_lst) / 1024 ** 2
+    mb_out = sum(r.size_out for r in ok_lst) / 1024 ** 2
+    sec = max(seconds, 1e-9)
+    print(f'=== Archive Result ===')
+    print(f'\tarchives  : {len(ok_lst)} created, {len(err_lst)} failed')
+    print(f'\tsize      : {mb_in:.1f} MB -> {mb_out:.1f} MB')
+    print(f'\ttime      : {seconds:.1f} s (sum of archives: {sum(r.seconds for r in result_lst):.1f} s)')
+    print(f'\tthroughput: {mb_in / sec:.1f} MB/s, {len(result_lst) / sec:.2f} archives/s')
+    for i, r in enumerate(err_lst):
+        print(f'\t{i}: {r.dir_in} {r.err}')
@@ -3,8 +3,8 @@ SendTo Command Line Interface
 """
 import sys
 import os
-import shutil
-import yaml
+import functools
+import collections
 
 from hlib import hpath
 from hlib import hrgx
@@ -12,6 +12,14 @@ from hlib import hdt
 from hlib import hxml
 from hlib import h7z
 from hlib import hcli
+from hlib import hidx
+from hlib import hflt
+from hlib import hign
+from hlib import hcopy
+from hlib import hzip
+from hlib import hcat
+from hlib import hcache
+from hlib import hrpt
 
 
 # 他のmoduleからこのfunctionをimportした場合、importしたcallerのmoduleのbatch scriptが作られる。
@@ -57,54 +65,67 @@ def _get_all_any(msg='Logic? 1=all or 0=any:'):
             print('Invalid Input.')
 
 
-# 動的にファイル・フォルダをフィルタリングをする関数を作成する。
+# 動的にファイル・フォルダをフィルタリングをするフィルタを作成する。
+# 戻り値のhflt.Filterは、Entryを受けて判定結果のBooleanを返す関数として使える。
+# フォルダの枝刈りは、filter.pruneを走査関数に渡す。
 def _create_filter_function():
-    # 判定に使う関数のリスト
-    # ユーザーの判断によりLambda関数をAppendする。
-    #
-    # Lambda関数の設計ルール
-    # 　「argument」は「Path object」
-    # 　「return」は判定結果の「Boolean」
-    fnc_lst = []
+    # 判定に使う関数は、ユーザーの判断によりフィルタに登録する。
+    # 判定関数はコストの安い順に評価され、結果が確定した時点で評価を打ち切る。
+    flt = hflt.Filter()
 
     # ---------------------------------------------------------------------------------
     # 正規表現
 
     # os.path.basenameでフィルタする？
     if hcli.get_yes_no(msg='Filter by Regex on Base Name?'):
-        pattern = hrgx.Prompt.get_pattern_ignore_case(msg='Basename Rgx:')
-        fnc_lst.append(lambda pat_obj: pattern.match(pat_obj.path) is not None)
+        flt.add_base_name_regex(hrgx.Prompt.get_pattern_ignore_case(msg='Basename Rgx:'))
 
     # 絶対パスでフィルタする？
     if hcli.get_yes_no(msg='Filter by Regex on Absolute Path?'):
-        pattern = hrgx.Prompt.get_pattern_ignore_case(msg='Absolute Path Rgx:')
-        fnc_lst.append(lambda pat_obj: pattern.match(pat_obj.base_name) is not None)
+        flt.add_path_regex(hrgx.Prompt.get_pattern_ignore_case(msg='Absolute Path Rgx:'))
+
+    # ---------------------------------------------------------------------------------
+    # 拡張子
+
+    if hcli.get_yes_no(msg='Filter by Extension?'):
+        flt.add_ext(hflt.Prompt.get_ext_lst())
 
     # ---------------------------------------------------------------------------------
     # タイムスタンプ
 
     # 更新日時　最小
     if hcli.get_yes_no(msg='Add Minimum Modified Date?'):
-        ts_min = hdt.DateTime.prompt_datetime(msg='Minimum Modified Date: ').timestamp()
-        fnc_lst.append(lambda pat_obj: pat_obj.time_stamp > ts_min)
+        flt.add_time_stamp_min(hdt.DateTime.prompt_datetime(msg='Minimum Modified Date: ').timestamp())
 
     # 更新日時　最大
     if hcli.get_yes_no(msg='Add Maximum Modified Date?'):
-        ts_max = hdt.DateTime.prompt_datetime(msg='Max Modified Date: ').timestamp()
-        fnc_lst.append(lambda pat_obj: pat_obj.time_stamp < ts_max)
+        flt.add_time_stamp_max(hdt.DateTime.prompt_datetime(msg='Max Modified Date: ').timestamp())
+
+    # ---------------------------------------------------------------------------------
+    # サイズ
+
+    if hcli.get_yes_no(msg='Add Minimum Size?'):
+        flt.add_size_min(hflt.Prompt.get_size(msg='Minimum Size (e.g. 100, 10k, 1.5M, 2G): '))
+
+    if hcli.get_yes_no(msg='Add Maximum Size?'):
+        flt.add_size_max(hflt.Prompt.get_size(msg='Maximum Size (e.g. 100, 10k, 1.5M, 2G): '))
+
+    # ---------------------------------------------------------------------------------
+    # フォルダの枝刈り
+    # 名称が合致したフォルダは、配下のファイルを一つずつ判定せずに、フォルダごと走査しない。
+
+    if hcli.get_yes_no(msg='Skip Folders by Regex on Base Name?'):
+        flt.add_dir_skip_regex(hrgx.Prompt.get_pattern_ignore_case(msg='Skipped Folder Rgx:'))
 
     # --------------------------------------------------------------------------------
     # 関数「all()」もしくは、関数「any()」をユーザーから取得する。
-    all_or_any = _get_all_any()
+    # 判定関数が一つ以下なら、どちらでも結果は同じなので聞かない。
+    if len(flt.fnc_lst) > 1:
+        flt.logic = _get_all_any()
 
-    # 関数を作る
-    def fnc_ret(pat_obj):
-        # fnc_lstが空なら判別する必要が無いので「True」を返す。
-        # fnc_lstが空でないなら、all もしくは any で、ファイル・フォルダの合否を判定する。。
-        return True if len(fnc_lst) == 0 else all_or_any([fnc(pat_obj) for fnc in fnc_lst])
-
-    # 構築された関数を渡す。
-    return fnc_ret
+    # 構築されたフィルタを渡す。
+    flt.compile()
+    return flt
 
 
 # 中間フォルダを作る関数。
@@ -118,27 +139,6 @@ def _wrap_make_dirs(dst_dir):
         print(f'created "{dst_dir}"')
 
 
-# ファイルやフォルダをコピーする。
-# Callerは、ファイルか？フォルダか？を意識しなくてよい。
-def _wrap_copy(src_abs, dst_dir):
-    # 出力フォルダの確認
-    dst_type = hpath.get_path_type(dst_dir)
-    if dst_type != 'dir':
-        raise ValueError(f'{dst_dir} is not a folder.')
-
-    # 入力フォルダの確認
-    src_type = hpath.get_path_type(src_abs)
-
-    if src_type == 'file':
-        shutil.copy2(src_abs, dst_dir)
-        print(f'copied file "{src_abs}" to "{dst_dir}".')
-    elif src_type == 'dir':
-        shutil.copytree(src_abs, dst_dir)
-        print(f'copied dir "{src_abs}" to "{dst_dir}".')
-    else:
-        raise ValueError(f'f"{src_abs}" is neither file or folder.')
-
-
 class Cli:
     # ---------------------------------------------------------------
     # パスの設定関数
@@ -192,6 +192,67 @@ class Cli:
         if self.dir_out_type != 'dir':
             self.set_dir_out()
 
+    # 入力フォルダを走査する時に、インデックスを使うか？をユーザーに設定させる。
+    def set_use_index(self):
+        """Read file lists from an on-disk index of the input folder"""
+        self.use_index = hcli.get_yes_no('Use index?')
+
+    # インデックスの更新で、更新日時が変わっていないフォルダも読み込み直すか？をユーザーに設定させる。
+    # フォルダの更新日時は、中のファイルの上書きでは変わらないので、ファイルのサイズ・更新日時が古い場合に使う。
+    def set_index_full_rescan(self):
+        """Re-read every folder when updating the index (refreshes file sizes and dates)"""
+        self.index_full_rescan = hcli.get_yes_no('Re-read every folder when updating the index?')
+
+    # フォルダを同時に読み込むスレッド数をユーザーに設定させる。
+    # ネットワークドライブの場合は、16～32程度にすると走査が速くなる。
+    def set_scan_workers(self):
+        """Set the number of folders listed concurrently (1=serial)"""
+        self.scan_workers = hcli.get_int('Scan Workers')
+        self.scan_ordered = hcli.get_yes_no('Keep the serial order?')
+
+    # XMLの解析結果のキャッシュを使うか？をユーザーに設定させる。
+    def set_use_result_cache(self):
+        """Reuse cached XML analysis results for unchanged files"""
+        self.use_result_cache = hcli.get_yes_no(f'Use result cache? (results are saved to {hcache.FP_CACHE})')
+
+    # 走査しないファイル・フォルダの除外パターンをユーザーに設定させる。
+    def set_excludes(self):
+        """Set exclude globs and whether to read .gitignore style files in the input folder"""
+        self.exclude_globs = input('Exclude globs separated by space (e.g. node_modules/ .git/ *.tmp): ').split()
+        self.use_ignore_files = hcli.get_yes_no(f'Read {" ".join(hign.IGNORE_FILES)} in the input folder?')
+
+    # 走査関数に渡すpruneを返す。
+    # 除外パターンと、引数のprune(フィルタの枝刈り等)のどちらかがTrueなら、走査しない。
+    def _get_prune(self, prune=None):
+        prune_lst = [prune] if prune else []
+        if self.path_in_type == 'dir' and (self.exclude_globs or self.use_ignore_files):
+            fn_lst = hign.IGNORE_FILES if self.use_ignore_files else []
+            matcher = hign.Matcher.from_files(self.path_in, glob_lst=self.exclude_globs, fn_lst=fn_lst)
+            prune_lst.insert(0, matcher.prune)
+
+        if len(prune_lst) == 0:
+            return None
+        elif len(prune_lst) == 1:
+            return prune_lst[0]
+        else:
+            return lambda entry: any(fnc(entry) for fnc in prune_lst)
+
+    # 入力フォルダの走査関数を返す。
+    # 関数の引数と戻り値は、hpath.Dir.scan()と同じ。
+    # インデックスを使う場合は、インデックスを更新してから、インデックスの走査関数を返す。
+    # pruneは、Entryを走査しない場合にTrueを返す関数。除外パターンも追加される。
+    def _get_scan_fnc(self, prune=None):
+        prune = self._get_prune(prune)
+        if self.use_index:
+            # インデックスは、走査が終わったら閉じる。
+            def scan_index(target='file', recursive=True):
+                with hidx.Index(self.path_in) as idx:
+                    idx.rescan(full=self.index_full_rescan, prune=prune)
+                    yield from idx.scan(target=target, recursive=recursive, prune=prune)
+            return scan_index
+        return functools.partial(hpath.Dir(self.path_in).scan_parallel,
+                                 workers=self.scan_workers, ordered=self.scan_ordered, prune=prune)
+
     def path(self):
         """Set paths..."""
 
@@ -204,12 +265,21 @@ class Cli:
 \tpath in type :   {self.path_in_type}
 \tdir out      :   {self.dir_out}
 \tdir out type :   {self.dir_out_type}
+\tuse index    :   {self.use_index} (full rescan: {self.index_full_rescan})
+\tscan workers :   {self.scan_workers} (ordered: {self.scan_ordered})
+\texcludes     :   {self.exclude_globs} (ignore files: {self.use_ignore_files})
+\tresult cache :   {self.use_result_cache}
 """)
 
         cmd_fnc = {'set path in': self.set_path_in,
                    'set dir in': self.set_dir_in,
                    'set file in': self.set_file_in,
                    'set dir out': self.set_dir_out,
+                   'set use index': self.set_use_index,
+                   'set index full rescan': self.set_index_full_rescan,
+                   'set scan workers': self.set_scan_workers,
+                   'set excludes': self.set_excludes,
+                   'set use result cache': self.set_use_result_cache,
                    'print paths': print_paths}
 
         hcli.launch_prompt_loop(cmd_fnc=cmd_fnc, title='Path')
@@ -225,25 +295,36 @@ class Cli:
 
         def archive_child_dirs():
             """archive each child folder"""
+            # 圧縮レベル
+            # 既に圧縮されているファイル(JPEG、MP4、ZIP等)は、レベルに関わらず無圧縮で格納される。
+            level = hzip.Prompt.get_level()
+
+            # 既存のZIPファイルがあれば、変わったファイルだけを更新する。
+            update = hcli.get_yes_no('Update existing archives (only changed files)?')
+
+            # 圧縮の予定のリスト
+            job_lst = []
+
             # 同じパスに保存
             if hcli.get_yes_no('Save to the same location?'):
-                # ループ
                 for dir_child in hpath.Dir(self.path_in).mapper(target='dir', recursive=False):
-                    ret = shutil.make_archive(base_name=dir_child,
-                                              format='zip',
-                                              root_dir=dir_child)
-                    print(f'Created "{ret}".')
+                    job_lst.append(hzip.Job(dir_in=dir_child, fp_out_wo_ext=dir_child, level=level, update=update))
             # 別のパスに保存
             else:
                 # 未設定の場合は出力フォルダを設定してもらう。
                 self._set_dir_out()
-                # ループ
-                rel_obj = hpath.Rel(self.path_in, dir_out=self.dir_out, target='dir', recursive=False)
+                rel_obj = hpath.Rel(self.path_in, dir_out=self.dir_out, target='dir', recursive=False, lazy=True)
                 for rel_tpl in rel_obj.yield_rel_tpl():
-                    ret = shutil.make_archive(base_name=rel_tpl.dst_abs,
-                                              format='zip',
-                                              root_dir=rel_tpl.src_abs)
-                    print(f'Created "{ret}".')
+                    job_lst.append(hzip.Job(dir_in=rel_tpl.src_abs, fp_out_wo_ext=rel_tpl.dst_abs, level=level,
+                                            update=update))
+
+            # 同時に圧縮するプロセス数
+            # 圧縮は一つのCPUコアしか使わないので、子フォルダが多い場合はCPU数まで増やすと速くなる。
+            workers = hcli.get_int(f'Archive Workers (CPU count: {os.cpu_count()})')
+
+            # 圧縮して、結果を表示する。
+            result_lst, seconds = hzip.run_jobs(job_lst, workers=workers)
+            hzip.print_report(result_lst, seconds)
 
         # ユーザーが選択するコマンドの辞書
         cmd_fnc = {'archive child dirs': archive_child_dirs,
@@ -265,11 +346,14 @@ class Cli:
             # 読み込み失敗したファイルのリスト
             fp_err_lst = []
 
+            # パーシングするプロセス数。1の場合はこのプロセスで順番に読み込む。
+            workers = hcli.get_int('Parse Processes (1=serial)')
+
             # ループ
-            for i, fp in enumerate(hxml.yield_fp(self.path_in)):
+            fp_itr = hxml.yield_fp(self.path_in, scan_fnc=self._get_scan_fnc())
+            for i, (fp, err) in enumerate(hxml.map_files(hxml.check_file, ((fp, fp) for fp in fp_itr), workers)):
                 print(f'\r{i} {fp}', end='')
-                obj = hxml.Xml(fp)
-                if obj.err:
+                if err:
                     fp_err_lst.append(fp)
 
             # 結果を表示する。
@@ -277,32 +361,16 @@ class Cli:
             for i, fp_err in enumerate(fp_err_lst):
                 print(f'{i}: {fp_err}')
 
-        # ファイル書き込み機能にエラー処理を付けたラッパー
-        # 内部関数なのでユーザーから直接は実行されない。
-        def _prettify_sub(fp_in, fp_out):
-            # 現在読み込んでいるファイルを表示する。
-            print(f'\rReading {fp_in}', end='')
-            # ファイルを読み込む。
-            obj = hxml.Xml(fp_in)
-            # 成功した場合はファイルに書き込む。
-            if obj.err is None:
-                obj.pretty_write_utf8(fp_out)
-            # エラーが発生したら、ループを止める。
-            else:
-                print(f'\nERROR! Failed to parse{fp_in}.')
-                print(obj.err)
-                input(f'Press enter to continue...')
-
         # XMLファイルをフォーマットする。
         def prettify_utf8():
             """Format XML files in UT-8 Encoding"""
+            # (表示するファイル, (入力ファイル, 出力ファイル))のリスト
+            item_itr = []
+
             # 上書き
             if hcli.get_yes_no('Overwrite?'):
-                # ループ
-                for fp_in in hxml.yield_fp(self.path_in):
-                    _prettify_sub(fp_in=fp_in, fp_out=fp_in)
-                # ループ終了
-                print('\ncompleted.')
+                fp_itr = hxml.yield_fp(self.path_in, scan_fnc=self._get_scan_fnc())
+                item_itr = ((fp_in, (fp_in, fp_in)) for fp_in in fp_itr)
 
             # 新規ファイルに出力
             else:
@@ -311,90 +379,154 @@ class Cli:
 
                 # 入力がフォルダの場合
                 if self.path_in_type == 'dir':
-                    rel_obj = hpath.Rel(path=self.path_in, dir_out=self.dir_out)
-                    # ループ
-                    for rel_tpl in rel_obj.yield_rel_tpl():
-                        # 'src_abs', 'src_rel', 'dst_abs', 'dst_dir'
-                        # 拡張子がＸＭＬの場合
-                        if hpath.File(rel_tpl.src_abs).ext_upper == '.XML':
-                            # 中間フォルダを作成する。
-                            _wrap_make_dirs(rel_tpl.dst_dir)
-                            # ファイルに書き込む
-                            _prettify_sub(fp_in=rel_tpl.src_abs, fp_out=rel_tpl.dst_abs)
-                    # ループ終了
-                    print('\ncompleted.')
+                    rel_obj = hpath.Rel(path=self.path_in, dir_out=self.dir_out, lazy=True,
+                                        scan_fnc=self._get_scan_fnc())
+
+                    def yield_items():
+                        for rel_tpl in rel_obj.yield_rel_tpl():
+                            # 'src_abs', 'src_rel', 'dst_abs', 'dst_dir'
+                            # 拡張子がＸＭＬの場合
+                            if hpath.File(rel_tpl.src_abs).ext_upper == '.XML':
+                                # 中間フォルダを作成する。
+                                _wrap_make_dirs(rel_tpl.dst_dir)
+                                yield rel_tpl.src_abs, (rel_tpl.src_abs, rel_tpl.dst_abs)
+
+                    item_itr = yield_items()
 
                 # 入力がファイルの場合
                 elif self.path_in_type == 'file':
-                    fp_out = os.path.join(self.dir_out + hpath.File(self.path_in).base_name)
-                    # ファイルに書き込む
-                    _prettify_sub(fp_in=self.path_in, fp_out=fp_out)
+                    fp_out = os.path.join(self.dir_out, hpath.File(self.path_in).base_name)
+                    item_itr = [(self.path_in, (self.path_in, fp_out))]
+
+            # 整形したバイト列が既存のファイルと同じ場合は書き込まない。
+            skip_unchanged = hcli.get_yes_no('Skip files whose bytes are unchanged?')
+            # 整形するプロセス数。1の場合はこのプロセスで順番に整形する。
+            workers = hcli.get_int('Parse Processes (1=serial)')
+
+            # ループ
+            counter = collections.Counter()
+            err_lst = []
+            fnc = functools.partial(hxml.prettify_file, skip_unchanged=skip_unchanged)
+            for fp_in, status in hxml.map_files(fnc, item_itr, workers):
+                print(f'\r{status} {fp_in}', end='')
+                if status in (hxml.PRETTY_WRITTEN, hxml.PRETTY_UNCHANGED):
+                    counter[status] += 1
+                else:
+                    err_lst.append((fp_in, status))
+            # ループ終了
+            print(f'\ncompleted. written: {counter[hxml.PRETTY_WRITTEN]}, '
+                  f'unchanged: {counter[hxml.PRETTY_UNCHANGED]}, errors: {len(err_lst)}')
+            for fp_in, err in err_lst:
+                print(f'{fp_in}: {err}')
 
         # データ集計関数を受けて、データを集計して結果をYAMLに出力する関数。
         # 渡す関数によって、任意のデータ解析が可能になる。
+        # プロセスプールで実行できるように、関数はhxmlのモジュールの関数(もしくはそのfunctools.partial)にする。
+        # queryは解析の内容を表す文字列で、キャッシュのキーになる。Noneの場合はキャッシュを使わない。
+        # fn_outは拡張子無しの出力ファイル名称、key_columnsはCSVの場合のキーの列の名称(hrpt.CsvWriterを参照)
+        # 結果は一件ずつ出力ファイルに書き込むので、メモリに溜めない。
         # 内部関数なのでユーザーから直接は実行されない。
-        def _get_data(fnc_get_data, fn_out='count.yml'):
+        # row_fnc、row_columnsは、CSVの場合の行の作り方(hrpt.open_writer()を参照)
+        # keepは、結果を受けて書き込むか？を返す関数。Noneの場合は全て書き込む。
+        def _get_data(fnc_get_data, fn_out='count', query=None, key_columns=(), row_fnc=None, row_columns=None,
+                      keep=None):
             # 出力フォルダを確保する。
             self._set_dir_out()
 
-            # 出力リスト
-            result = []
+            # 出力形式
+            fmt = hrpt.Prompt.get_format()
+
+            # パーシングするプロセス数。1の場合はこのプロセスで順番に読み込む。
+            workers = hcli.get_int('Parse Processes (1=serial)')
 
-            # 出力リストにデータを加える。
-            # 簡単な処理だけど、複数の箇所で使われているので、
-            # DictionaryのKeyをTypoしてKeyが不整合を起こさないようにFunctionにしておく。
-            def append_result(file, data):
-                result.append({'file': file, 'data': data})
+            # (出力するファイル名称, 入力ファイルの絶対パス)のイテラブル
+            item_itr = []
 
             # 入力がフォルダの場合
             if self.path_in_type == 'dir':
-                rel_obj = hpath.Rel(path=self.path_in, dir_out=self.dir_out)
-                # ループ
-                for rel_tpl in rel_obj.yield_rel_tpl():
-                    # 'src_abs', 'src_rel', 'dst_abs', 'dst_dir'
-                    # 拡張子がＸＭＬの場合
-                    if hpath.File(rel_tpl.src_abs).ext_upper == '.XML':
-                        # カウントする
-                        # ファイルは相対パス
-                        append_result(file=rel_tpl.src_rel, data=fnc_get_data(rel_tpl.src_abs))
-                # ループ終了
-                print('\nloop completed.')
+                rel_obj = hpath.Rel(path=self.path_in, dir_out=self.dir_out, lazy=True,
+                                    scan_fnc=self._get_scan_fnc())
+                # 'src_abs', 'src_rel', 'dst_abs', 'dst_dir'
+                # 拡張子がＸＭＬの場合
+                # ファイルは相対パス
+                item_itr = ((rel_tpl.src_rel, rel_tpl.src_abs) for rel_tpl in rel_obj.yield_rel_tpl()
+                            if rel_tpl.entry.ext_upper == '.XML')
 
             # 入力がファイルの場合
             elif self.path_in_type == 'file':
-                fp_out = os.path.join(self.dir_out + hpath.File(self.path_in).base_name)
-                # カウントする
                 # ファイルはファイル名称
-                append_result(file=hpath.File(self.path_in).base_name, data=fnc_get_data(self.path_in))
+                item_itr = [(hpath.File(self.path_in).base_name, self.path_in)]
+
+            # ライターを先に開いて、キャッシュを開けなかった場合もライターを閉じる。
+            writer = hrpt.open_writer(fmt, os.path.join(self.dir_out, fn_out), key_columns=key_columns,
+                                      row_columns=row_columns, row_fnc=row_fnc)
+            count = 0
+            cache = None
+            try:
+                # キャッシュを使う場合は、サイズと更新日時が変わっていないファイルを解析しない。
+                if self.use_result_cache and query is not None:
+                    cache = hcache.ResultCache()
+                    itr = cache.map(fnc_get_data, item_itr, query=query, workers=workers)
+                else:
+                    itr = hxml.map_files(fnc_get_data, item_itr, workers)
 
-            # YAMLファイル出力
-            fp_out = os.path.join(self.dir_out, fn_out)
-            with open(fp_out, 'w') as f:
-                yaml.dump(result, f, default_flow_style=False)
-            print(f'{fp_out} was created.')
+                # ループ
+                # 結果は、入力の順番で返ってくる。
+                for file, data in itr:
+                    count += 1
+                    # 出力ファイルに書き込む
+                    if keep is None or keep(data):
+                        writer.write(file=file, data=data)
+            finally:
+                if cache:
+                    cache.close()
+                writer.close()
+            # ループ終了
+            print('\nloop completed.')
+            print(f'{writer.fp_out} was created. ({writer.count} of {count} files)')
 
         def count_tags():
             """Count element names per file."""
 
-            def get_tag_count(fp_in):
-                return dict(hxml.Xml(fp_in).count_tag_names())
-
-            _get_data(get_tag_count, fn_out='tag_count.yml')
+            _get_data(hxml.get_tag_count, fn_out='tag_count', query='tags', key_columns=('tag',))
 
         def count_xpath():
             """Count items based on XPath expression"""
             xpath = hxml.get_xpath()
-
-            def get_xpath_count(fp_in):
-                return hxml.Xml(fp_in).count_by_xpath(xpath=xpath)
-
-            _get_data(get_xpath_count, fn_out='xpath_count.yml')
+            # ストリーミングで数えられない式の場合、大きなファイルもツリーを作って数える。
+            if not hxml.is_stream_path(xpath):
+                print(f'note: files over {hxml.STREAM_SIZE // 1024 ** 2} MB will be loaded into memory for this XPath.')
+
+            _get_data(functools.partial(hxml.get_xpath_count, xpath=xpath), fn_out='xpath_count',
+                      query=f'xpath:{xpath}')
+
+        def count_queries():
+            """Count element names and several XPath expressions in one parse per file"""
+            xpath_lst = hxml.get_xpath_lst()
+            count_tags = hcli.get_yes_no('Count element names too?')
+            fnc = functools.partial(hxml.get_query_counts, xpath_tpl=tuple(xpath_lst), count_tags=count_tags)
+            _get_data(fnc, fn_out='query_count', query=f'queries:{count_tags}:' + '\n'.join(xpath_lst),
+                      key_columns=('type', 'name'), row_fnc=hxml.get_query_rows)
+
+        def validate_schema():
+            """Validate XML files against an XSD/RelaxNG schema and report errors with line numbers"""
+            # スキーマは、各プロセスで一回だけコンパイルする。
+            fp_schema = os.path.abspath(hxml.get_schema())
+            # スキーマとinclude/importで読み込むファイルの更新日時。キャッシュのキーにする。
+            stamp = hxml.get_schema_stamp(fp_schema)
+
+            # 妥当でないファイルだけを書き込む。
+            _get_data(functools.partial(hxml.validate_file, fp_schema=fp_schema, stamp=stamp),
+                      fn_out='validation_error', query=hxml.get_schema_query(fp_schema, stamp),
+                      row_columns=('line', 'column', 'message'), keep=bool)
 
         # ユーザーが選択するコマンドの辞書
         cmd_fnc = {'check corruption': check_corruption,
+                   'validate schema': validate_schema,
                    'pretty utf8': prettify_utf8,
                    'count tags': count_tags,
-                   'count xpath': count_xpath}
+                   'count xpath': count_xpath,
+                   'count queries': count_queries}
 
         # ループを開始
         hcli.launch_prompt_loop(cmd_fnc=cmd_fnc, title='XML')
@@ -407,35 +539,136 @@ class Cli:
             # 入力フォルダ設定する
             self._set_dir_in()
 
+            # 圧縮コマンドのリスト
+            cmd_lst = []
+
+            # 7z.exeが見つからない場合は、このプロセスの中で圧縮する。暗号化はできないので、パスワード無しになる。
+            # 暗号化されていない圧縮ファイルを作るので、ユーザーが了承しない場合は中止する。
+            backend = h7z.get_default_backend()
+            is_in_process = isinstance(backend, h7z.InProcessBackend)
+            if is_in_process:
+                print(f'7z.exe was not found (set {h7z.ENV_EXE} to its path). In-process archives can not be encrypted.')
+                if not hcli.get_yes_no('Create archives WITHOUT password?'):
+                    print('canceled.')
+                    return
+
             # 同じパスに保存
             if hcli.get_yes_no('Save to the same location?'):
                 # ループ
                 for dir_child in hpath.Dir(self.path_in).mapper(target='dir', recursive=False):
                     p = hpath.Path(dir_child)
                     # パスワードはフォルダの名称にする。
-                    obj = h7z.Add(dir_in=dir_child, dir_out=p.parent, fn_out_wo_ext=p.base_name, pwd=p.base_name)
-                    stmt = obj.construct_statement()
-                    h7z.execute_statement(stmt)
+                    cmd_lst.append(h7z.Add(dir_in=dir_child, dir_out=p.parent, fn_out_wo_ext=p.base_name,
+                                           pwd=None if is_in_process else p.base_name, backend=backend))
             # 別のパスに保存
             else:
                 # 未設定の場合は出力フォルダを設定してもらう。
                 self._set_dir_out()
                 # ループ
-                rel_obj = hpath.Rel(self.path_in, dir_out=self.dir_out, target='dir', recursive=False)
+                rel_obj = hpath.Rel(self.path_in, dir_out=self.dir_out, target='dir', recursive=False, lazy=True)
                 for rel_tpl in rel_obj.yield_rel_tpl():
                     p = hpath.Path(rel_tpl.src_abs)
-                    obj = h7z.Add(dir_in=rel_tpl.src_abs, dir_out=rel_tpl.dst_dir,
-                                  fn_out_wo_ext=p.base_name, pwd=p.base_name)
-                    stmt = obj.construct_statement()
-                    h7z.execute_statement(stmt)
+                    cmd_lst.append(h7z.Add(dir_in=rel_tpl.src_abs, dir_out=rel_tpl.dst_dir, fn_out_wo_ext=p.base_name,
+                                           pwd=None if is_in_process else p.base_name, backend=backend))
+
+            # 同時に実行する7z.exeの数と、全体で使うスレッド数
+            # スレッド数は、各7z.exeに均等に割り振られる。
+            workers = hcli.get_int('Concurrent 7z Jobs')
+            cpu_budget = hcli.get_int(f'Total Threads (CPU count: {os.cpu_count()})')
+
+            # 実行して、結果を表示する。
+            result_lst = h7z.Runner(workers=workers, cpu_budget=cpu_budget).run(cmd_lst)
+            h7z.print_summary(result_lst)
+            print(f'metrics: {h7z.FP_METRICS}')
+
+        def extract_archives():
+            """extract each archive into its own folder"""
+            # 入力フォルダ設定する
+            self._set_dir_in()
+
+            # 圧縮ファイル(分割されている場合は「.001」だけ)と、解凍先のフォルダのリスト
+            # 解凍先は、拡張子無しの圧縮ファイルの名称のフォルダ
+            job_lst = []
+            if hcli.get_yes_no('Extract to the same location?'):
+                for entry in self._get_scan_fnc()():
+                    if hcat.is_archive(entry.path):
+                        job_lst.append((entry.path, os.path.join(os.path.dirname(entry.path),
+                                                                 hcat.get_archive_stem(entry.path))))
+            else:
+                # 未設定の場合は出力フォルダを設定してもらう。
+                self._set_dir_out()
+                rel_obj = hpath.Rel(self.path_in, dir_out=self.dir_out, lazy=True, scan_fnc=self._get_scan_fnc())
+                for rel_tpl in rel_obj.yield_rel_tpl():
+                    if hcat.is_archive(rel_tpl.src_abs):
+                        job_lst.append((rel_tpl.src_abs, os.path.join(rel_tpl.dst_dir,
+                                                                      hcat.get_archive_stem(rel_tpl.src_abs))))
+            print(f'{len(job_lst)} archives found.')
+            if len(job_lst) == 0:
+                return
+
+            # 「archive child dirs」で作った圧縮ファイルは、拡張子無しの名称がパスワード
+            if hcli.get_yes_no('Is the password the archive name?'):
+                pwd_fnc = hcat.get_pwd_from_name
+            else:
+                pwd = input('Password (empty for none): ')
+                pwd_fnc = lambda fp: pwd if pwd else None
+
+            # 同時に実行する7z.exeの数(解凍はスレッド数を指定しない)
+            workers = hcli.get_int('Concurrent 7z Jobs')
+            runner = h7z.Runner(workers=workers)
+
+            # 先に全ての圧縮ファイルをテストして、壊れているものは解凍しない。
+            if hcli.get_yes_no('Test the archives before extracting?'):
+                result_lst = runner.run([h7z.Test(fp_in, pwd=pwd_fnc(fp_in)) for fp_in, dir_out in job_lst])
+                h7z.print_summary(result_lst)
+                job_lst = [job for job, result in zip(job_lst, result_lst)
+                           if result.return_code == h7z.ErrorCode.NO_ERROR]
+                print(f'{len(job_lst)} archives passed the test.')
+
+            # 解凍して、結果を表示する。
+            cmd_lst = [h7z.Extract(fp_in, dir_out, archive_type=None, pwd=pwd_fnc(fp_in)) for fp_in, dir_out in job_lst]
+            result_lst = runner.run(cmd_lst)
+            h7z.print_summary(result_lst)
+            print(f'metrics: {h7z.FP_METRICS}')
 
         # ユーザーが選択するコマンドの辞書
         cmd_fnc = {'archive child dirs': archive_child_dirs,
+                   'extract archives': extract_archives,
                    }
 
         # ループを開始
         hcli.launch_prompt_loop(cmd_fnc=cmd_fnc, title='7zip')
 
+    def catalog(self):
+        """Archive catalog commands..."""
+
+        def update_catalog():
+            """list the members of the archives in the input folder"""
+            # 入力フォルダ設定する
+            self._set_dir_in()
+
+            # 「7z」で作った圧縮ファイルは、拡張子無しの名称がパスワード
+            pwd_fnc = hcat.get_pwd_from_name if hcli.get_yes_no('Is the password the archive name?') else None
+            workers = hcli.get_int('Concurrent Jobs')
+
+            # 一覧を取得できなかった圧縮ファイルは、Catalog.update()が表示する。
+            with hcat.Catalog() as catalog:
+                catalog.update(self.path_in, pwd_fnc=pwd_fnc, workers=workers)
+
+        def find_in_catalog():
+            """find the archives that have the matching files"""
+            pattern = input('Wild Card (e.g. */report_2023*.xml): ')
+            with hcat.Catalog() as catalog:
+                hcat.print_hits(catalog, pattern)
+
+        # ユーザーが選択するコマンドの辞書
+        cmd_fnc = {'update catalog': update_catalog,
+                   'find in catalog': find_in_catalog,
+                   }
+
+        # ループを開始
+        hcli.launch_prompt_loop(cmd_fnc=cmd_fnc, title='Catalog')
+
     def grep(self):
         """Grep commands..."""
         # 入力ファイル・フォルダ設定する
@@ -451,9 +684,12 @@ class Cli:
                 # まず、フィルタ関数を作る
                 is_passed = _create_filter_function()
                 # ファイルをループしつつ、合致条件のファイルパスを返す。
-                for fp in hpath.Dir(path=self.path_in).mapper():
-                    if is_passed(hpath.Path(fp)):
-                        yield fp
+                # Entryはstat情報をキャッシュしているので、フィルタで再度statを呼ばない。
+                # フォルダの判定関数が無い場合は枝刈りしない(インデックスの範囲検索を使える)。
+                prune = is_passed.prune if is_passed.has_dir_fnc else None
+                for entry in self._get_scan_fnc(prune=prune)():
+                    if is_passed(entry):
+                        yield entry.path
 
         # 正規表現を作る。
         def create_rgx_from_sample():
@@ -497,27 +733,97 @@ class Cli:
         self._set_dir_in()
         self._set_dir_out()
 
-        # ファイルをコピーしたいのか、それとも、フォルダをコピーしたいのか？
-        target = hpath.Prompt.get_target()
-
-        # 再帰検索するか？
-        recursive = hcli.get_yes_no('Recursively?')
-
-        # フィルタ関数
-        is_passed = _create_filter_function()
-
-        # ループ
-        rel_obj = hpath.Rel(path=self.path_in, dir_out=self.dir_out, target=target, recursive=recursive)
-        # rel_tplは、collections.namedtuple
-        # member は ['src_abs', 'src_rel', 'dst_abs', 'dst_dir']
-        for rel_tpl in rel_obj.yield_rel_tpl():
-            # Pathオブジェクトを作成し、フィルタする
-            pat_obj = hpath.Path(rel_tpl.src_abs)
-            if is_passed(pat_obj):
-                # 中間フォルダを構築
-                _wrap_make_dirs(rel_tpl.dst_dir)
-                # ターゲットのコピー
-                _wrap_copy(rel_tpl.src_abs, rel_tpl.dst_dir)
+        # ジャーナル：中断しても、再実行すると未完了のファイルだけをコピーする。
+        journal = None
+        resume = False
+        if hcli.get_yes_no('Resumable copy with a journal?'):
+            journal = hcopy.Journal(self.path_in, self.dir_out)
+            count_pending = journal.count_pending
+            if journal.is_planned() and count_pending > 0:
+                resume = hcli.get_yes_no(f'Resume the previous copy? ({count_pending} remaining)')
+
+        # 再開する場合は、前回の予定を使うので、走査の条件は聞かない。
+        if not resume:
+            # ファイルをコピーしたいのか、それとも、フォルダをコピーしたいのか？
+            target = hpath.Prompt.get_target()
+
+            # 再帰検索するか？
+            recursive = hcli.get_yes_no('Recursively?')
+
+            # フィルタ関数
+            is_passed = _create_filter_function()
+
+        # 同時にコピーするスレッド数
+        # NASに小さいファイルを大量にコピーする場合は、多めにすると速くなる。
+        workers = hcli.get_int('Copy Workers')
+
+        # 同期モード：出力先に同じファイルがあればコピーしない。
+        sync = hcli.get_yes_no('Sync (skip unchanged files)?')
+        use_hash = sync and hcli.get_yes_no('Compare by content hash instead of modified date?')
+        # 再開する場合は、前回コピーしたファイルが分からないので、余分なファイルは探さない。
+        check_extras = sync and not resume and hcli.get_yes_no('Check extra files at the destination?')
+
+        if resume:
+            rel_tpl_itr = journal.yield_pending()
+        else:
+            # 走査しながら、フィルタに合格したRelTplを渡す。
+            # フォルダの判定関数が無い場合は枝刈りしない(インデックスの範囲検索を使える)。
+            prune = is_passed.prune if is_passed.has_dir_fnc else None
+            rel_obj = hpath.Rel(path=self.path_in, dir_out=self.dir_out, target=target, recursive=recursive,
+                                lazy=True, scan_fnc=self._get_scan_fnc(prune=prune))
+            # rel_tplは、collections.namedtuple
+            # member は ['src_abs', 'src_rel', 'dst_abs', 'dst_dir', 'entry']
+            # 走査時に取得したEntryオブジェクトでフィルタする
+            rel_tpl_itr = (rel_tpl for rel_tpl in rel_obj.yield_rel_tpl() if is_passed(rel_tpl.entry))
+            # フォルダを再帰的にコピーする場合、配下のフォルダは親フォルダのコピーに含まれるので渡さない。
+            if target == 'dir' and recursive:
+                rel_tpl_itr = hcopy.skip_nested_dirs(rel_tpl_itr)
+
+        # フォルダをコピーする場合は、コピーしたフォルダの中で余分なファイルを探す。
+        dst_dir_lst = []
+        if check_extras and target == 'dir':
+            def record(itr):
+                for rel_tpl in itr:
+                    dst_dir_lst.append(rel_tpl.dst_abs)
+                    yield rel_tpl
+            rel_tpl_itr = record(rel_tpl_itr)
+        elif check_extras:
+            dst_dir_lst.append(self.dir_out)
+
+        # ジャーナルに予定を記録してから、ジャーナルの予定をコピーする。
+        if journal is not None and not resume:
+            print('planning...')
+            journal.plan(rel_tpl_itr)
+            rel_tpl_itr = journal.yield_pending()
+
+        # コピーして、結果を表示する。
+        # ジャーナルを使う場合は、書きかけのファイルを残さないように一時ファイル経由で書き込む。
+        copier = hcopy.Copier(workers=workers, sync=sync, use_hash=use_hash, track=check_extras,
+                              atomic=journal is not None, journal=journal)
+        summary = copier.run(rel_tpl_itr)
+        hcopy.print_summary(summary)
+
+        # 未完了のファイルが残っていれば、ジャーナルを残す。
+        if journal is not None:
+            count_pending = journal.finish()
+            if count_pending > 0:
+                print(f'{count_pending} items remain. Run copy with the journal again to resume.')
+
+        # 出力先にだけ存在するファイル
+        # フィルタで除外されたファイルも含まれるので、削除する前に一覧を確認すること。
+        if check_extras:
+            extras = list(copier.find_extras(dst_dir_lst, recursive=recursive or target == 'dir'))
+            print(f'=== Extra Files Count=({len(extras)}) ===')
+            for i, fp in enumerate(extras):
+                print(f'{i}: {fp}')
+            if len(extras) > 0 and hcli.get_yes_no('Delete the extra files?'):
+                for fp in extras:
+                    try:
+                        os.remove(fp)
+                    except OSError as e:
+                        print(f'ERROR: failed to delete {fp}. {e}')
+                    else:
+                        print(f'deleted "{fp}"')
 
     # コンストラクタ
     def __init__(self):
@@ -525,6 +831,18 @@ class Cli:
         self.path_in_type = 'err'
         self.dir_out = None
         self.dir_out_type = 'err'
+        # 入力フォルダの走査にインデックスを使うか？
+        self.use_index = False
+        # インデックスの更新で、全てのフォルダを読み込み直すか？
+        self.index_full_rescan = False
+        # 入力フォルダを走査するスレッド数と、順番を保つか？
+        self.scan_workers = 1
+        self.scan_ordered = True
+        # 除外パターンと、入力フォルダの除外ファイルを読むか？
+        self.exclude_globs = []
+        self.use_ignore_files = False
+        # XMLの解析結果のキャッシュを使うか？ディスクに書き込むので、既定では使わない。
+        self.use_result_cache = False
 
         # SendToで入力パスが渡されている場合、入力パスとタイプを設定する。
         if len(sys.argv) == 2:
@@ -539,6 +857,7 @@ class Cli:
             'copy': self.copy,
             'zip': self.zip,
             '7z': self.seven,
+            'catalog': self.catalog,
             'xml': self.xml,
             'grep': self.grep,
             # 一度しか使わない設定コマンド